@@ -2,11 +2,11 @@ from argparse import ArgumentParser
 from typing import Optional, List
 from pathlib import Path
 
-from .gui import main as gui_main
 from .messages import messages, option_messages
 from .lib import config as configlib
-from .data import Data, Config, CONFIG_DEFAULT
+from .defaults import Config, CONFIG_DEFAULT
 from .info import __version__, APPNAME
+from .profiler import profiler
 
 
 __all__ = (
@@ -28,6 +28,14 @@ def main(args: Optional[List[str]] = None) -> None:
     parser_mode.add_argument(
         "--register", "-r",
         action="store_true")
+    parser_mode.add_argument(
+        "--watch",
+        action="store_true",
+        help=option_messages.watch)
+    parser_mode.add_argument(
+        "--serve",
+        action="store_true",
+        help=option_messages.serve)
     parser_mode.add_argument(
         "--deploy-result",
         action="store_true",
@@ -36,6 +44,22 @@ def main(args: Optional[List[str]] = None) -> None:
         "--export",
         required=False, default=None,
         help="Export results to a CSV file")
+    parser_mode.add_argument(
+        "--convert-imgstore",
+        action="store_true",
+        help=option_messages.convertimgstore)
+    parser_mode.add_argument(
+        "--restore",
+        required=False, default=None, type=int, metavar="N",
+        help=option_messages.restore)
+    parser_mode.add_argument(
+        "--compact",
+        action="store_true",
+        help=option_messages.compact)
+    parser_mode.add_argument(
+        "--prune-cache",
+        action="store_true",
+        help=option_messages.prunecache)
     parser_mode.add_argument(
         "--create-config-file",
         action="store_true",
@@ -65,6 +89,18 @@ def main(args: Optional[List[str]] = None) -> None:
         "--config-section",
         required=False, default="annotation",
         help=option_messages.configsection)
+    parser.add_argument(
+        "--workers", "-j",
+        required=False, default=None, type=int,
+        help=option_messages.workers)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=option_messages.incremental)
+    parser.add_argument(
+        "--profile",
+        required=False, default=None, metavar="TRACE_FILE",
+        help=option_messages.profile)
     parser.add_argument(
         "--verbose", "-v",
         action="store_true")
@@ -99,6 +135,8 @@ def main(args: Optional[List[str]] = None) -> None:
         config["workdir"] = args.workdir
     if args.cmap_file is not None:
         config["cmapfile"] = args.cmap_file
+    if args.workers is not None:
+        config["workers"] = args.workers
     config.conv()
     config["verbose"] = bool(config["verbose"] + args.verbose)
 
@@ -111,6 +149,20 @@ def main(args: Optional[List[str]] = None) -> None:
             section=None)
         return None
 
+    if args.profile is None:
+        return _main(args=args, config=config)
+
+    profiler.enable()
+    try:
+        return _main(args=args, config=config)
+    finally:
+        profiler.disable()
+        print(profiler.summary())
+        profiler.write_trace(args.profile)
+        print(f"profile: {args.profile}")
+
+
+def _main(args, config: Config) -> None:
     if args.deploy_result:
         # Deploy annotated images only
         config["n"] = 0
@@ -118,16 +170,22 @@ def main(args: Optional[List[str]] = None) -> None:
 
     # GUI
     if args.gui:
+        from .gui import main as gui_main
         gui_main(config=config, args=args)
         return None
 
     # Initialize 'Data' class
+    from .data import Data
     data = Data(config)
 
     if args.create_sample_datafile:
         data.create_sample_datafile()
         return None
 
+    if args.prune_cache:
+        data.prune_cache()
+        return None
+
     # Load pickle datafile
     data.load()
 
@@ -135,14 +193,24 @@ def main(args: Optional[List[str]] = None) -> None:
         data.deploy()
     elif args.register:
         data.register()
+    elif args.watch:
+        data.watch()
+    elif args.serve:
+        data.serve()
+    elif args.compact:
+        data.compact()
+    elif args.restore is not None:
+        data.restore(args.restore)
+    elif args.convert_imgstore:
+        data.convert_imgstore()
     elif args.export is not None:
         export_file = args.export
         _export = True
-        if Path(export_file).is_file():
+        if Path(export_file).is_file() and not args.incremental:
             r = input(f"{export_file} {messages.replace} (y/n)")
             if r.lower() not in ["y", "yes"]:
                 _export = False
         if _export:
-            data.export(export_file)
+            data.export(export_file, incremental=args.incremental)
 
     return None
@@ -0,0 +1,56 @@
+"""Label-column delta backups
+
+Each save writes one generation: the previous labels of the changed rows.
+Generation 1 is the newest (the state before the last save).
+"""
+import json
+import gzip
+from datetime import datetime
+from pathlib import Path
+from typing import Union, List, Tuple
+
+
+class LabelBackup(object):
+    suffix = ".json.gz"
+
+    def __init__(self, dirpath: Union[Path, str], verbose: bool = False) -> None:
+        self.dirpath = Path(dirpath)
+        self.verbose = verbose
+        return None
+
+    def generations(self) -> List[Path]:
+        """Backup files (newest first)"""
+        if not self.dirpath.is_dir():
+            return list()
+        return sorted(self.dirpath.glob(f"*{self.suffix}"), reverse=True)
+
+    def write(self, ids: List[str], labels: List[str], generations: int = 1) -> Path:
+        """Write previous labels of changed rows and remove old generations.
+
+        Args:
+            ids (list): Ids of changed rows
+            labels (list): Previous labels of changed rows
+            generations (int, optional): Number of generations to keep
+
+        Returns:
+            Path: Backup file
+        """
+        self.dirpath.mkdir(exist_ok=True, parents=True)
+        time = datetime.now()
+        filepath = self.dirpath / (time.strftime("%Y%m%d%H%M%S%f") + self.suffix)
+        with gzip.open(filepath, mode="wt", encoding="utf-8") as f:
+            json.dump(
+                dict(time=time.isoformat(), ids=list(ids), labels=list(labels)),
+                f, ensure_ascii=False)
+        if self.verbose:
+            print(f"backup: {filepath} ({len(ids)} labels)")
+
+        for old in self.generations()[generations:]:
+            old.unlink()
+        return filepath
+
+    @staticmethod
+    def read(filepath: Union[Path, str]) -> Tuple[List[str], List[str]]:
+        with gzip.open(filepath, mode="rt", encoding="utf-8") as f:
+            d = json.load(f)
+        return d["ids"], d["labels"]
@@ -0,0 +1,228 @@
+"""Persistent on-disk caches"""
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Union, Optional, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from .profiler import profiler
+
+if TYPE_CHECKING:
+    from .render import Renderer
+
+
+class RenderCache(object):
+    """Content-addressed cache of rendered images.
+
+    Key = hash(image bytes, dtype, shape, render settings, imgext).
+    Files are stored as `<dirpath>/<key[:2]>/<key><imgext>` and
+    hard-linked (or copied) to the working directory.
+    Least recently used files are evicted when the cache exceeds `size` MB.
+    """
+    def __init__(
+        self,
+        dirpath: Union[Path, str],
+        size: Optional[float] = None,
+        verbose: bool = False,
+    ) -> None:
+        self.dirpath = Path(dirpath)
+        self.size = size
+        self.verbose = verbose
+        return None
+
+    @staticmethod
+    def key(m: np.ndarray, settings: str) -> str:
+        m = np.ascontiguousarray(m)
+        h = hashlib.blake2b(digest_size=20)
+        h.update(settings.encode())
+        h.update(f"{m.dtype.str}{m.shape}".encode())
+        h.update(m.data)
+        return h.hexdigest()
+
+    def path(self, key: str, imgext: str) -> Path:
+        return self.dirpath / key[:2] / (key + imgext)
+
+    @staticmethod
+    def _link(src: Path, dst: Union[Path, str]) -> None:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+        return None
+
+    def save_images(
+        self,
+        renderer: "Renderer",
+        imgs: List[np.ndarray],
+        filepaths: List[str],
+        imgext: str,
+        **kwargs,
+    ) -> Tuple[int, int]:
+        """Render cache-missed images only, then link all from the cache.
+
+        Args:
+            renderer (Renderer): Renderer
+            imgs (list): 2d images
+            filepaths (list): Output file paths
+            imgext (str): Image file extension
+            kwargs: Passed to `render.save_images`
+
+        Returns:
+            tuple: (number of hits, number of misses)
+        """
+        from .render import save_images
+        settings = renderer.settings + imgext
+        paths = [self.path(self.key(m, settings), imgext) for m in imgs]
+
+        miss = dict()
+        for i, path in enumerate(paths):
+            if path not in miss and not path.is_file():
+                miss[path] = i
+        for path in miss.keys():
+            path.parent.mkdir(exist_ok=True, parents=True)
+        save_images(
+            renderer=renderer,
+            imgs=[imgs[i] for i in miss.values()],
+            filepaths=[str(path) for path in miss.keys()],
+            **kwargs,
+        )
+
+        for path, filepath in zip(paths, filepaths):
+            # NOTE: mtime is used as the last access time (LRU)
+            os.utime(path)
+            self._link(path, filepath)
+
+        n_miss = len(miss)
+        n_hit = len(paths) - n_miss
+        profiler.count("cache.hit", n_hit)
+        profiler.count("cache.miss", n_miss)
+        if self.verbose:
+            print(f"cache: hit={n_hit} miss={n_miss}")
+        if n_miss > 0:
+            self.prune()
+        return (n_hit, n_miss)
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        files = list()
+        if not self.dirpath.is_dir():
+            return files
+        for subdir in os.scandir(self.dirpath):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.is_file():
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        return files
+
+    def prune(self, size: Optional[float] = None) -> Tuple[int, int]:
+        """Evict least recently used files until the cache fits `size` MB.
+
+        Args:
+            size (float, optional): Size limit [MB] (If None, use self.size.
+                If both are None, nothing is evicted.)
+
+        Returns:
+            tuple: (number of removed files, removed bytes)
+        """
+        if size is None:
+            size = self.size
+        if size is None:
+            return (0, 0)
+
+        files = self._scan()
+        limit = int(size * 1024 * 1024)
+        total = sum(f[1] for f in files)
+        n_removed = 0
+        n_bytes = 0
+        for _, filesize, filepath in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.unlink(filepath)
+            except FileNotFoundError:
+                pass
+            total -= filesize
+            n_removed += 1
+            n_bytes += filesize
+        if self.verbose:
+            print(f"cache.prune: removed {n_removed} files ({n_bytes} bytes)")
+        return (n_removed, n_bytes)
+
+
+class LoadCache(object):
+    """Uncompressed copy of the last loaded datafile.
+
+    The copy is used only while the datafile's mtime, size and
+    content hash are unchanged.
+    """
+    def __init__(
+        self,
+        dirpath: Union[Path, str],
+        verbose: bool = False,
+    ) -> None:
+        self.dirpath = Path(dirpath)
+        self.verbose = verbose
+        return None
+
+    def paths(self, datafile: Union[Path, str]) -> Tuple[Path, Path]:
+        key = hashlib.blake2b(
+            str(Path(datafile).resolve()).encode(), digest_size=8).hexdigest()
+        return (self.dirpath / f"{key}.pkl", self.dirpath / f"{key}.json")
+
+    @staticmethod
+    def _stat(datafile: Union[Path, str], chunksize: int = 1 << 24) -> dict:
+        st = os.stat(datafile)
+        h = hashlib.blake2b(digest_size=20)
+        with open(datafile, mode="rb") as f:
+            for chunk in iter(lambda: f.read(chunksize), b""):
+                h.update(chunk)
+        return dict(
+            datafile=str(Path(datafile).resolve()),
+            mtime_ns=st.st_mtime_ns,
+            size=st.st_size,
+            hash=h.hexdigest(),
+        )
+
+    def read(self, datafile: Union[Path, str]) -> Optional[pd.DataFrame]:
+        """Read cached DataFrame (None if missing or stale)."""
+        cachefile, metafile = self.paths(datafile)
+        if not (cachefile.is_file() and metafile.is_file()):
+            return None
+        try:
+            with metafile.open(mode="r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        st = os.stat(datafile)
+        if (meta.get("mtime_ns"), meta.get("size")) != (st.st_mtime_ns, st.st_size):
+            return None
+        if meta.get("hash") != self._stat(datafile)["hash"]:
+            return None
+        if self.verbose:
+            print(f"loadcache: {cachefile}")
+        return pd.read_pickle(cachefile, compression=None)
+
+    def write(self, datafile: Union[Path, str], df: pd.DataFrame) -> None:
+        self.invalidate(datafile)
+        cachefile, metafile = self.paths(datafile)
+        self.dirpath.mkdir(exist_ok=True, parents=True)
+        tmpfile = cachefile.with_suffix(".tmp")
+        df.to_pickle(tmpfile, compression=None)
+        os.replace(tmpfile, cachefile)
+        with metafile.open(mode="w") as f:
+            json.dump(self._stat(datafile), f)
+        if self.verbose:
+            print(f"loadcache: write {cachefile}")
+        return None
+
+    def invalidate(self, datafile: Union[Path, str]) -> None:
+        # NOTE: remove metadata first (cache without metadata is never read)
+        for path in reversed(self.paths(datafile)):
+            if path.is_file():
+                path.unlink()
+        return None
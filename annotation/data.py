@@ -1,96 +1,177 @@
+import io
+import os
+import gzip
+import pickle
+import sys
 import shutil
 import json
+import subprocess
+import threading
+import time
+from uuid import uuid4
+from datetime import datetime
 from pathlib import Path
-from typing import Union, Optional, List, Tuple
+from typing import Union, Optional, List, Tuple, TYPE_CHECKING
 from warnings import warn
 
-from tqdm import tqdm
+import numpy as np
 import pandas as pd
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
-import seaborn as sns
 
 from . import cmap
+from .defaults import Config, CONFIG_DEFAULT
+from .cache import RenderCache, LoadCache
+from .store import ImageStore
+from .backup import LabelBackup
+from .labelindex import LabelIndex
+from .watch import LabelDirWatcher
+from .features import FeatureCache
+from . import features as featurelib
+from .dedup import DuplicateGroups
+from . import dedup as deduplib
+from .model import NearestCentroid
+from .profiler import profiler
 from .lib import random as randomlib
+from .lib import compression as compressionlib
+
+if TYPE_CHECKING:
+    # matplotlib is imported on the first render (see `Data.get_renderer`)
+    from .render import Renderer
 
 
 Figsize = Union[List[Union[int, float]], Tuple[Union[int, float]], float, int]
-CONFIG_DEFAULT = dict(
-    # NOTE: values must be int or float or str
-    datafile = "./data.pkl.xz",
-    workdir = "./work",
-    cmapfile = "",
-    n = 30,
-    n_example = 5,
-    col_filename = "id",
-    col_img = "img",
-    col_label = "label",
-    labels = "none",
-    label_null = "",
-    random = 1,
-    imgext = ".png",
-    cmap = "",
-    vmin = 0.0,
-    vmax = 1.0,
-    figsize = "4,4",
-    backup = 1,
-    verbose = 0,
-)
-
-
-class Config(dict):
-    def conv(self) -> None:
-        for k in self.keys():
-            # Optional
-            if k in ["cmapfile", "cmap", "n", "n_example", "vmin", "vmax"]:
-                if self[k] == "":
-                    self[k] = None
-            if self[k] is None:
+# file name (without imgext) of example montage in each label directory
+MONTAGE_NAME = "_examples"
+# manifest of a prefetched batch (ids, render settings)
+PREFETCH_MANIFEST = ".prefetch.json"
+# manifest of deployed files (file names, ids, directories, inodes)
+DEPLOY_MANIFEST = ".manifest.npz"
+# file name prefix (order) of similarity-ordered batch
+SEQUENCE_FORMAT = "{:04d}_"
+# age [s] of a prefetch lock regarded as stale (Windows, where the owner cannot be checked)
+PREFETCH_LOCK_TIMEOUT = 3600
+# labelled rows per label to fit the presort model
+MODEL_SAMPLES = 2000
+
+
+def shard_names(names: pd.Index, width: int) -> np.ndarray:
+    """Shard subdirectory of each file name (`width` hex digits of its hash)."""
+    h = pd.util.hash_array(np.asarray(names, dtype=object))
+    buckets = (h % np.uint64(16 ** width)).astype(np.int64)
+    return np.array([f"{b:0{width}x}" for b in buckets], dtype=object)
+
+
+def scan_files(
+    dirpath: Union[Path, str],
+    imgext: str,
+) -> Tuple[List[str], List[str], List[int]]:
+    """Files in a directory tree (one os.scandir walk).
+
+    Returns:
+        tuple: (names without imgext, top-level subdirectory ('' for dirpath), inodes)
+    """
+    n = len(imgext)
+    names = list()
+    topdirs = list()
+    inodes = list()
+    stack = [(str(dirpath), "")]
+    while len(stack) > 0:
+        path, topdir = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, topdir or entry.name))
+                elif entry.name.endswith(imgext):
+                    names.append(entry.name[:-n])
+                    topdirs.append(topdir)
+                    inodes.append(entry.inode())
+    return (names, topdirs, inodes)
+
+
+def _rmtree(path: str) -> None:
+    """Remove directory tree with os.scandir (bottom-up, no path list in memory)."""
+    stack = [(path, False)]
+    while len(stack) > 0:
+        dirpath, scanned = stack.pop()
+        if scanned:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
                 pass
-            else:
-                # bool
-                if k in ["random", "backup", "verbose"]:
-                    self[k] = bool(self[k])
-                # int
-                if k in ["n", "n_example"]:
-                    self[k] = int(self[k])
-                # float
-                if k in ["vmin", "vmax"]:
-                    self[k] = float(self[k])
-                # list(separator=",")
-                if k in ["labels", "figsize"]:
-                    if self[k] == "":
-                        self[k] = list()
-                    else:
-                        self[k] = self[k].split(",")
-                # list[float]
-                if k in ["figsize"]:
-                    self[k] = [float(x) for x in self[k]]
-                # Path
-                if k in ["cmapfile", "datafile"]:
-                    self[k] = Path(self[k])
-        return None
+            continue
+        stack.append((dirpath, True))
+        try:
+            entries = os.scandir(dirpath)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                else:
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+    return None
 
-    def conv_to_str(self) -> None:
-        for k, v in self.items():
-            if v is None:
-                self[k] = ""
-            elif type(v) is bool:
-                self[k] = str(int(v))
-            elif type(v) is list:
-                self[k] = ",".join([str(x) for x in v])
-            else:
-                self[k] = str(v)
-        return None
+
+# deletion of a trash directory (run by `_WorkDir._clear_fast` in a detached process)
+_RMTREE_SCRIPT = "import sys, shutil; shutil.rmtree(sys.argv[1], ignore_errors=True)"
 
 
 class _WorkDir(type(Path())):
     imgext: str = ""
     verbose: bool = False
     labels: List[str] = list()
+    fast: bool = False
+    # background deletion processes (see `_WorkDir.wait`)
+    _procs: List[subprocess.Popen] = list()
 
+    @property
+    def _trash_prefix(self) -> str:
+        return f".{self.name}.trash-"
+
+    def _clear_fast(self) -> bool:
+        """Move workdir to trash and delete it in background.
+
+        Deletion runs in a detached process, so the CLI exits without waiting
+        (trash left by an interrupted deletion is deleted by the next clear).
+        """
+        # trash left by previous runs
+        active = {p.args[-1] for p in _WorkDir._procs if p.poll() is None}
+        trashes = [
+            p for p in self.parent.glob(self._trash_prefix + "*")
+            if p.is_dir() and str(p) not in active]
+        if self.is_dir():
+            trash = self.parent / (self._trash_prefix + uuid4().hex[:8])
+            try:
+                os.rename(self, trash)
+            except OSError:
+                return False
+            trashes.append(trash)
+        for trash in trashes:
+            proc = subprocess.Popen(
+                [sys.executable, "-c", _RMTREE_SCRIPT, str(trash)],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+            _WorkDir._procs.append(proc)
+        return True
+
+    @staticmethod
+    def wait() -> None:
+        """Wait for background deletion."""
+        while len(_WorkDir._procs) > 0:
+            _WorkDir._procs.pop().wait()
+        return None
+
+    @profiler.profile("workdir.clear")
     def clear(
         self,
         make_labeldirs: bool = True,
@@ -98,19 +179,32 @@ class _WorkDir(type(Path())):
         if self.verbose:
             print(f"clear: {str(self)}")
 
+        if self.fast and self._clear_fast():
+            self.mkdir(exist_ok=True, parents=True)
+            if make_labeldirs:
+                for label in self.labels:
+                    (self / label).mkdir(exist_ok=False)
+            return None
+
         self.mkdir(exist_ok=True, parents=True)
+        manifest = self / DEPLOY_MANIFEST
+        if manifest.is_file():
+            manifest.unlink()
 
         filepaths = list(self.glob(f"**/*{self.imgext}"))
         if len(filepaths) > 0:
+            from tqdm import tqdm
             for filepath in tqdm(filepaths):
                 if filepath.is_file():
                     filepath.unlink()
-        for dirpath in self.iterdir():
-            if dirpath.is_dir():
-                try:
-                    dirpath.rmdir()
-                except Exception:
-                    pass
+        # bottom-up (shard subdirectories first)
+        for dirpath, _, _ in os.walk(self, topdown=False):
+            if dirpath == str(self):
+                continue
+            try:
+                os.rmdir(dirpath)
+            except Exception:
+                pass
 
         # make subdirs
         if make_labeldirs:
@@ -145,6 +239,13 @@ class Data(object):
         self.loaded = False
         self.df = pd.DataFrame()
         self.cmaps: dict
+        self._imgstore: Optional[ImageStore] = None
+        self._label_index: Optional[LabelIndex] = None
+        self._prefetch_thread: Optional[threading.Thread] = None
+        self._features: Optional[np.ndarray] = None
+        self._dup_groups: Optional[DuplicateGroups] = None
+        self._near_groups: Optional[DuplicateGroups] = None
+        self._rng = np.random.default_rng()
         self.__configkeys = list(default.keys())
         for k in self.__configkeys:
             if k in config:
@@ -157,11 +258,18 @@ class Data(object):
         self.workdir.imgext = self.imgext
         self.workdir.verbose = self.verbose
         self.workdir.labels = self.labels
+        self.workdir.fast = self.fastclear
 
         if self.verbose:
             print(config)
         return None
 
+    @property
+    def n_workers(self) -> int:
+        if not self.workers:
+            return os.cpu_count() or 1
+        return self.workers
+
     def get_config(self, str: bool = False) -> Config:
         c = Config()
         for k in self.__configkeys:
@@ -181,18 +289,33 @@ class Data(object):
         elif type == "all":
             l =  len(self)
         elif type == "annotated":
-            l =  (self.df[self.col_label]!=self.label_null).sum()
+            l =  len(self) - self._label_index.count(self.label_null)
         else:
             raise ValueError(f"Type '{type}' is not defined")
         return l
 
+    def get_load_cache(self) -> Optional[LoadCache]:
+        if self.loadcache is None:
+            return None
+        return LoadCache(self.loadcache, verbose=self.verbose)
+
+    @profiler.profile("load")
     def load(self) -> None:
-        self.df = pd.read_pickle(self.datafile)
+        loadcache = self.get_load_cache()
+        df = None if loadcache is None else loadcache.read(self.datafile)
+        if df is None:
+            with profiler.phase("load.read_pickle"):
+                df = self._read_pickle(self.datafile, workers=self.n_workers)
+            if loadcache is not None:
+                loadcache.write(self.datafile, df)
+        self.df = df
 
         if self.col_label not in self.df.columns:
             self.df[self.col_label] = self.label_null
         else:
             self.df[self.col_label] = self.df[self.col_label].astype(str)
+        # labels in the datafile (for delta backups)
+        self._saved_labels = self._copy_labels()
 
         if self.verbose:
             print(self.info())
@@ -205,6 +328,14 @@ class Data(object):
             nunique = self.df[self.col_filename].nunique()
         if len(self.df) != nunique:
             raise ValueError(f"Each value of '{self.col_filename}' must be unique")
+        self._build_id_index()
+        self._label_index = None
+        self._features = None
+        with profiler.phase("load.journal"):
+            self._replay_journal()
+        self._build_label_index()
+        self._open_imgstore()
+        self._build_dup_groups()
 
         for label in self.df[self.col_label].unique():
             if label == self.label_null:
@@ -229,35 +360,228 @@ class Data(object):
         self.loaded = True
         return None
 
+    def _build_id_index(self) -> None:
+        # id(str) -> row position
+        if self._index_as_filename:
+            ids = self.df.index
+        else:
+            ids = self.df[self.col_filename]
+        self._id_index = pd.Index(ids.astype(str))
+        return None
+
+    @profiler.profile("load.label_index")
+    def _build_label_index(self) -> None:
+        # label -> row positions (updated by _set_labels)
+        self._label_index = LabelIndex(self.df[self.col_label].to_numpy(dtype=object))
+        return None
+
+    @profiler.profile("load.dedup")
+    def _build_dup_groups(self) -> None:
+        # rows with the same image hash (see dedup.py)
+        self._dup_groups = None
+        self._near_groups = None
+        if not self.dedup:
+            return None
+        if self.dedup not in (deduplib.EXACT, deduplib.PERCEPTUAL):
+            raise ValueError(f"dedup must be 0, 1 or 2 (got {self.dedup})")
+        codes, near_codes = deduplib.read_or_compute(
+            self.datafile, self._id_index, self._images_fingerprint(),
+            lambda: self.get_imgs(np.arange(len(self.df))),
+            perceptual=(self.dedup == deduplib.PERCEPTUAL), verbose=self.verbose)
+        self._dup_groups = DuplicateGroups(codes)
+        if near_codes is not None:
+            self._near_groups = DuplicateGroups(near_codes)
+        if self.verbose:
+            print(f"dedup: {self._dup_groups.n_duplicates} duplicates")
+            if self._near_groups is not None:
+                print(f"dedup: {self._near_groups.n_duplicates} near-duplicates")
+        return None
+
+    def _suggest_near_duplicates(self, positions: np.ndarray) -> np.ndarray:
+        """Label of a labelled near-duplicate of each row (None if there is none)."""
+        groups = self._near_groups
+        members = groups.members(positions)
+        col = self.df[self.col_label].to_numpy()
+        members = members[col[members] != self.label_null]
+        lut = dict(zip(groups.codes[members].tolist(), col[members]))
+        return np.array([lut.get(c) for c in groups.codes[positions].tolist()], dtype=object)
+
+    def _exclude_duplicates(self, exclude: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """`exclude` and unlabeled rows which are not the representative
+        (the first unlabeled row) of their duplicate group."""
+        if self._dup_groups is None:
+            return exclude
+        dups = self._dup_groups.non_representatives(
+            self._label_index.positions(self.label_null))
+        if exclude is None or len(exclude) == 0:
+            return dups
+        return np.concatenate([np.asarray(exclude, dtype=np.int64), dups])
+
+    def _get_positions(self, names: List[str]) -> np.ndarray:
+        """Row positions of ids (-1 if not found)"""
+        return self._id_index.get_indexer(names)
+
+    def _copy_labels(self) -> np.ndarray:
+        # NOTE: np.array always copies (Series.to_numpy(copy=True) may return a view)
+        return np.array(self.df[self.col_label].to_numpy(dtype=object), dtype=object)
+
+    def _set_labels(self, positions: np.ndarray, label: str) -> None:
+        if len(positions) == 0:
+            return None
+        self.df.iloc[positions, self.df.columns.get_loc(self.col_label)] = label
+        if self._label_index is not None:
+            self._label_index.move(positions, label)
+        return None
+
+    @property
+    def imgstorepath(self) -> Path:
+        return Path(str(self.datafile) + ".imgs")
+
+    def _open_imgstore(self) -> None:
+        self._imgstore = None
+        if self.col_img in self.df.columns:
+            return None
+        if not ImageStore.exists(self.imgstorepath):
+            warn(f"Column '{self.col_img}' is not found")
+            return None
+        self._imgstore = ImageStore.open(self.imgstorepath)
+        # row position -> store position
+        self._imgstore_pos = self._imgstore.ids.get_indexer(self._id_index)
+        if (self._imgstore_pos < 0).any():
+            raise ValueError(f"Some ids are not found in {self.imgstorepath}")
+        if self.verbose:
+            print(f"data.load: image store {self.imgstorepath} ({len(self._imgstore)} images)")
+        return None
+
+    def get_imgs(self, positions: np.ndarray) -> List[np.ndarray]:
+        """Images of rows (by row position)"""
+        if self._imgstore is None:
+            col = self.df.columns.get_loc(self.col_img)
+            return list(self.df.iloc[positions, col])
+        store = self._imgstore
+        return [store[i] for i in self._imgstore_pos[positions]]
+
+    def convert_imgstore(self, backup: Optional[bool] = None) -> None:
+        """Move the image column to a memory-mapped image store."""
+        if not self.loaded:
+            warn("Data is not loaded")
+            return None
+        if self._imgstore is not None:
+            print(f"convert_imgstore: already converted ({self.imgstorepath})")
+            return None
+
+        if backup is None:
+            backup = self.backup
+        if backup and self.datafile.is_file():
+            # labels are unchanged (no label backup), keep the original with the image column
+            backupfile = str(self.datafile) + "~"
+            print(f"convert_imgstore: backup {backupfile}")
+            shutil.copyfile(str(self.datafile), backupfile)
+        print(f"convert_imgstore: {self.imgstorepath}")
+        ImageStore.convert(
+            imgs=self.df[self.col_img].tolist(),
+            ids=self._id_index,
+            path=self.imgstorepath,
+        )
+        self.df = self.df.drop(columns=self.col_img)
+        self.save(backup=backup, clear_workdir=False)
+        self._open_imgstore()
+        return None
+
+    @property
+    def journalfile(self) -> Path:
+        return Path(str(self.datafile) + ".journal")
+
+    def _append_journal(self, names: np.ndarray, labels: np.ndarray) -> None:
+        if len(names) == 0:
+            return None
+        time = datetime.now().isoformat(timespec="seconds")
+        lines = [
+            json.dumps(dict(id=name, label=label, time=time), ensure_ascii=False)
+            for name, label in zip(names, labels)
+        ]
+        with self.journalfile.open(mode="a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        if self.verbose:
+            print(f"data.journal: {len(lines)} records -> {self.journalfile}")
+        return None
+
+    def _replay_journal(self) -> None:
+        if not self.journalfile.is_file():
+            return None
+        records = dict()
+        with self.journalfile.open(mode="r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # incomplete last line (interrupted write)
+                    warn(f"Invalid journal record: {line}")
+                    continue
+                # the last record of each id wins
+                records[record["id"]] = record["label"]
+        if self.verbose:
+            print(f"data.journal: replay {len(records)} records")
+
+        self._set_labels_by_ids(
+            names=list(records.keys()),
+            labels=list(records.values()),
+            context="Journal",
+        )
+        return None
+
+    def _set_labels_by_ids(
+        self,
+        names: List[str],
+        labels: List[str],
+        context: str = "",
+    ) -> None:
+        names = np.array(names, dtype=object)
+        labels = np.array(labels, dtype=object)
+        positions = self._get_positions(names)
+        found = positions >= 0
+        for name in names[~found]:
+            warn(f"{context}: name '{name}' is not found")
+        for label in pd.unique(labels[found]):
+            self._set_labels(positions[found & (labels == label)], label)
+        return None
+
     def info(self) -> None:
         print("data:", self.count("all"))
         print("annotated:", self.count("annotated"))
         return None
 
+    @profiler.profile("get_labelled")
     def get_labelled(
         self,
         n: int,
         label: Optional[str] = None,
         sample: bool = False,
         head: int = 0,
+        exclude: Optional[np.ndarray] = None,
     ) -> pd.DataFrame:
         if not self.loaded:
             warn("Data is not loaded")
             return None
 
-        df = self.df
-        if label is None:
-            _df = df[df[self.col_label]==self.label_null]
-        else:
-            _df = df[df[self.col_label]==label]
+        index = self._label_index
+        label_ = self.label_null if label is None else label
 
         if sample and (head > 0):
             warn("Both 'sample' and 'head' are selected")
-        if n is not None:
-            if sample:
-                _df = _df.sample(n=min(n,len(_df)))
-            if head > 0:
-                _df = _df.head(n)
+        n_exclude = 0 if exclude is None else len(exclude)
+        if n is not None and sample:
+            positions = index.sample(label_, n + n_exclude, rng=self._rng)
+        else:
+            positions = np.sort(index.positions(label_))
+        if n_exclude > 0:
+            positions = positions[~np.isin(positions, exclude)]
+        if n is not None and (sample or head > 0):
+            positions = positions[:n]
+        _df = self.df.iloc[positions]
         if self.verbose:
             print("data.get_labelled({}): {}".format(
                 "nolabel" if label is None else label,
@@ -266,14 +590,10 @@ class Data(object):
 
         return _df
 
-    def deploy(
+    def get_renderer(
         self,
         figsize: Optional[Figsize] = None
-    ) -> None:
-        if not self.loaded:
-            warn("Data is not loaded")
-            return None
-
+    ) -> "Renderer":
         if figsize is None:
             figsize = self.figsize
         if type(figsize) in (tuple, list):
@@ -286,54 +606,457 @@ class Data(object):
         else:  # float or int
             figsize = (figsize, figsize)
 
-        def _save_img(m, filepath) -> None:
-            if self.cmap in self.cmaps.keys():
-                _cmap = LinearSegmentedColormap.from_list(
-                    **self.cmaps[self.cmap]
-                )
-            else:
-                _cmap = self.cmap
-
-            fig = plt.figure(figsize=figsize)
-            ax = fig.add_subplot(111)
-            sns.heatmap(
-                m, vmin=self.vmin, vmax=self.vmax, cmap=_cmap,
-                cbar=False, xticklabels=[], yticklabels=[], ax=ax)
-            fig.savefig(filepath)
-            fig.clf()
-            plt.close()
-
-        def _save_imgs(df, dirpath: Path) -> None:
+        from .render import Renderer
+        return Renderer(
+            engine=self.renderer,
+            cmap=self.cmap,
+            cmaps=self.cmaps,
+            vmin=self.vmin,
+            vmax=self.vmax,
+            figsize=figsize,
+            discrete=self.discrete,
+        )
+
+    @profiler.profile("deploy")
+    def deploy(
+        self,
+        figsize: Optional[Figsize] = None
+    ) -> None:
+        if not self.loaded:
+            warn("Data is not loaded")
+            return None
+
+        renderer = self.get_renderer(figsize=figsize)
+        # a new deploy supersedes the prefetched batch
+        self._discard_prefetch()
+        self.workdir.clear()
+        positions, renamed, presorted, *batch = self._plan_deploy(self.workdir, renderer)
+        self._render_batch(renderer, *batch)
+        self._write_manifest(self.workdir, batch[1], renamed, presorted)
+        if self.prefetch and self.n:
+            self._start_prefetch(renderer, exclude=positions)
+        return None
+
+    def _plan_deploy(
+        self,
+        dirpath: Path,
+        renderer: "Renderer",
+        exclude: Optional[np.ndarray] = None,
+    ) -> tuple:
+        """Select rows of a batch (unlabeled rows and examples).
+
+        Returns:
+            tuple: (row positions of unlabeled rows, renamed files {file name: id},
+                presorted files {file name: label}, imgs, filepaths, montages)
+        """
+        imgs = list()
+        filepaths = list()
+        montages = list()
+        renamed = dict()
+        presorted = dict()
+        # one representative of each duplicate group
+        exclude = self._exclude_duplicates(exclude)
+        # fitted once for uncertainty sampling and presort
+        model = None
+        if self.presort is not None or self.uncertain:
+            model = self.get_model()
+
+        def _get_names(df) -> pd.Index:
             # sort
             if self._index_as_filename:
-                _idxs = df.index.sort_values()
+                return df.index.sort_values()
+            return pd.Index(df[self.col_filename].sort_values())
+
+        def _add_imgs(df, dirpath: Path, shard: bool = False) -> np.ndarray:
+            names = _get_names(df)
+            positions = self._get_positions(names.astype(str))
+            imgs.extend(self.get_imgs(positions))
+            if shard and self.shard > 0:
+                subdirs = shard_names(names.astype(str), self.shard)
+                for subdir in pd.unique(subdirs):
+                    (dirpath / subdir).mkdir(exist_ok=True)
+                filepaths.extend(
+                    str(dirpath / subdir / (str(name) + self.imgext))
+                    for name, subdir in zip(names, subdirs))
             else:
-                _idxs = df.sort_values(self.col_filename).index
-            if len(_idxs) == 0:
-                return None
+                filepaths.extend(
+                    str(dirpath / (str(name) + self.imgext)) for name in names)
+            return positions
 
-            # draw and save
-            for idx in tqdm(_idxs):
-                row = df.loc[idx]
-                if self._index_as_filename:
-                    filename = str(idx) + self.imgext
-                else:
-                    filename = str(row[self.col_filename]) + self.imgext
-                filepath = dirpath / filename
-                _save_img(m=row[self.col_img], filepath=str(filepath))
+        def _add_montage(df, dirpath: Path) -> None:
+            names = _get_names(df)
+            if len(names) == 0:
+                return None
+            montages.append((
+                self.get_imgs(self._get_positions(names.astype(str))),
+                dirpath / (MONTAGE_NAME + self.imgext),
+            ))
             return None
 
-        self.workdir.clear()
-        _df = self.get_labelled(
-            label=None, sample=self.random, head=not self.random, n=self.n)
-        _save_imgs(df=_df, dirpath=self.workdir)
+        if self.similar and self.n:
+            # similar images next to each other (file names sorted by order)
+            positions = self._select_similar(self.n, exclude=exclude)
+            imgs.extend(self.get_imgs(positions))
+            for i, name in enumerate(self._id_index[positions]):
+                filename = SEQUENCE_FORMAT.format(i) + name
+                renamed[filename] = name
+                filepaths.append(str(dirpath / (filename + self.imgext)))
+        else:
+            positions = None
+            if self.uncertain and self.n and model is not None:
+                positions = self._select_uncertain(model, self.n, exclude=exclude)
+            if positions is None:
+                _df = self.get_labelled(
+                    label=None, sample=self.random, head=not self.random, n=self.n,
+                    exclude=exclude)
+            else:
+                _df = self.df.iloc[positions]
+            positions = _add_imgs(df=_df, dirpath=dirpath)
+        if len(positions) > 0:
+            # suggested labels (confident predictions and labels of
+            # near-duplicates) into label directories
+            # (filepaths of unlabeled rows come first, in the order of positions)
+            suggested = np.full(len(positions), None, dtype=object)
+            if self.presort is not None and model is not None:
+                labels, confidence = model.predict(self.get_features(), positions)
+                confident = confidence >= self.presort
+                suggested[confident] = labels[confident]
+            if self._near_groups is not None:
+                near = self._suggest_near_duplicates(positions)
+                suggested = np.where(near != None, near, suggested)
+            for i in np.flatnonzero(suggested != None):
+                filename = Path(filepaths[i]).name
+                filepaths[i] = str(dirpath / suggested[i] / filename)
+                presorted[filename[:-len(self.imgext)]] = suggested[i]
+            if self.verbose and len(presorted) > 0:
+                print(f"data.deploy: presorted {len(presorted)} images")
         # Examples
+        montage = self.montage and (self.n_example is not None)
         for label in self.labels:
+            (dirpath / label).mkdir(exist_ok=True, parents=True)
             _df = self.get_labelled(
                 label=label, sample=True, n=self.n_example)
-            _save_imgs(df=_df, dirpath=(self.workdir / label))
+            if montage:
+                _add_montage(df=_df, dirpath=(dirpath / label))
+            else:
+                _add_imgs(df=_df, dirpath=(dirpath / label), shard=True)
+        return (positions, renamed, presorted, imgs, filepaths, montages)
+
+    def _render_batch(
+        self,
+        renderer: "Renderer",
+        imgs: List[np.ndarray],
+        filepaths: List[str],
+        montages: List[tuple],
+    ) -> None:
+        from .render import save_images, write_image
+        for _imgs, filepath in montages:
+            with profiler.phase("deploy.montage"):
+                write_image(renderer.montage(_imgs), filepath)
+
+        # draw and save
+        kwargs = dict(
+            renderer=renderer,
+            imgs=imgs,
+            filepaths=filepaths,
+            workers=self.workers,
+            maxtasksperchild=self.worker_maxtasks,
+        )
+        cache = self.get_render_cache()
+        if cache is None:
+            save_images(**kwargs)
+        else:
+            cache.save_images(imgext=self.imgext, **kwargs)
+        return None
+
+    @property
+    def prefetchdir(self) -> Path:
+        return self.workdir.parent / f".{self.workdir.name}.next"
+
+    @property
+    def _prefetch_lockfile(self) -> Path:
+        # pid of the process rendering a prefetch
+        return Path(str(self.prefetchdir) + ".lock")
+
+    def _prefetch_owner(self) -> Optional[int]:
+        """pid of the live process rendering a prefetch (None if none)"""
+        lockfile = self._prefetch_lockfile
+        try:
+            pid = int(lockfile.read_text())
+        except (OSError, ValueError):
+            return None
+        if pid == os.getpid():
+            return pid
+        if os.name == "nt":
+            # os.kill(pid, 0) terminates the process on Windows
+            try:
+                alive = time.time() - lockfile.stat().st_mtime < PREFETCH_LOCK_TIMEOUT
+            except OSError:
+                return None
+            return pid if alive else None
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass
+        return pid
+
+    def _lock_prefetch(self) -> bool:
+        """Take the prefetch lock (False if another live process has it)."""
+        lockfile = self._prefetch_lockfile
+        owner = self._prefetch_owner()
+        if owner is not None:
+            return owner == os.getpid()
+        # stale lock of a dead process
+        try:
+            lockfile.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            fd = os.open(str(lockfile), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, mode="w") as f:
+            f.write(str(os.getpid()))
+        return True
+
+    def _start_prefetch(
+        self,
+        renderer: "Renderer",
+        exclude: np.ndarray,
+    ) -> None:
+        """Render the next batch into `prefetchdir` in a background thread.
+
+        Rows are selected here (rows in `exclude` are skipped);
+        the thread only renders, then renames the staging directory
+        to `prefetchdir` (so `prefetchdir` is always complete).
+
+        The process holds `<prefetchdir>.lock` while rendering, so other
+        processes wait for it (`_wait_prefetch`) instead of touching its
+        staging directory. The process exits after the thread finishes.
+        """
+        if not self._lock_prefetch():
+            print("prefetch: another process is rendering the next batch")
+            return None
+        # staging directories of dead processes
+        for tmpdir in self.prefetchdir.parent.glob(self.prefetchdir.name + ".tmp*"):
+            _rmtree(str(tmpdir))
+        tmpdir = Path(f"{self.prefetchdir}.tmp-{os.getpid()}")
+        positions, renamed, presorted, *batch = self._plan_deploy(
+            tmpdir, renderer, exclude=exclude)
+        ids = list(self._id_index[positions])
+        filenames = {v: k for k, v in renamed.items()}
+        filenames = [filenames.get(name, name) for name in ids]
+        manifest = dict(
+            ids=ids,
+            # path relative to the batch directory (without imgext)
+            filenames=[
+                (presorted[name] + "/" + name) if name in presorted else name
+                for name in filenames],
+            settings=renderer.settings + self.imgext,
+        )
+
+        def _prefetch() -> None:
+            try:
+                self._render_batch(renderer, *batch)
+                self._write_manifest(tmpdir, batch[1], renamed, presorted)
+                with (tmpdir / PREFETCH_MANIFEST).open(mode="w") as f:
+                    json.dump(manifest, f)
+                os.rename(tmpdir, self.prefetchdir)
+            except Exception:
+                _rmtree(str(tmpdir))
+                raise
+            finally:
+                self._prefetch_lockfile.unlink()
+            if self.verbose:
+                print(f"prefetch: {self.prefetchdir} ({len(positions)} images)")
+            return None
+
+        print(f"prefetch: rendering the next batch in background ({len(positions)} images)")
+        self._prefetch_thread = threading.Thread(target=_prefetch, name="prefetch")
+        self._prefetch_thread.start()
+        return None
+
+    def _wait_prefetch(self) -> None:
+        if self._prefetch_thread is not None:
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        # prefetch rendered by another process (e.g. a previous -r still running)
+        waiting = False
+        while self._prefetch_owner() not in (None, os.getpid()):
+            if not waiting:
+                print("prefetch: waiting for another process")
+                waiting = True
+            time.sleep(0.1)
         return None
 
+    def _discard_prefetch(self) -> None:
+        self._wait_prefetch()
+        if self.prefetchdir.is_dir():
+            _rmtree(str(self.prefetchdir))
+        return None
+
+    @profiler.profile("prefetch.swap")
+    def _swap_prefetch(self, renderer: Optional["Renderer"] = None) -> bool:
+        """Move the prefetched batch into the (empty) workdir.
+
+        Rows labelled since the prefetch are removed from the batch.
+
+        Returns:
+            bool: True if swapped
+        """
+        self._wait_prefetch()
+        manifestfile = self.prefetchdir / PREFETCH_MANIFEST
+        if not manifestfile.is_file():
+            return False
+        with manifestfile.open(mode="r") as f:
+            manifest = json.load(f)
+        if renderer is None:
+            renderer = self.get_renderer()
+        if manifest.get("settings") != renderer.settings + self.imgext:
+            if self.verbose:
+                print("prefetch: settings changed, discarded")
+            self._discard_prefetch()
+            return False
+
+        names = np.array(manifest["ids"], dtype=object)
+        positions = self._get_positions(names)
+        found = positions >= 0
+        stale = ~found
+        stale[found] = (
+            self.df[self.col_label].to_numpy()[positions[found]] != self.label_null)
+        filenames = manifest.get("filenames", manifest["ids"])
+        for filename in np.array(filenames, dtype=object)[stale]:
+            try:
+                (self.prefetchdir / (filename + self.imgext)).unlink()
+            except FileNotFoundError:
+                pass
+
+        try:
+            os.rmdir(self.workdir)
+            os.rename(self.prefetchdir, self.workdir)
+        except OSError as e:
+            warn(f"prefetch: swap failed ({e})")
+            self.workdir.mkdir(exist_ok=True, parents=True)
+            return False
+        (self.workdir / PREFETCH_MANIFEST).unlink()
+        for label in self.labels:
+            (self.workdir / label).mkdir(exist_ok=True)
+        print(f"prefetch: deployed {int((~stale).sum())} images")
+        if self.n:
+            self._start_prefetch(renderer, exclude=positions[~stale])
+        return True
+
+    def _images_fingerprint(self) -> str:
+        """mtime and size of the file holding the images (image store or datafile)
+        (key of the caches derived from images)"""
+        if self._imgstore is not None:
+            path = ImageStore.paths(self.imgstorepath)[0]
+        else:
+            path = Path(self.datafile)
+        st = path.stat()
+        return f"{path.name}:{st.st_mtime_ns}:{st.st_size}"
+
+    def _refresh_image_caches(self, old: str) -> None:
+        """Keep caches derived from images valid after the datafile is saved."""
+        new = self._images_fingerprint()
+        if new == old:
+            return None
+        FeatureCache(self.datafile).refresh(old, new)
+        deduplib.refresh(self.datafile, self._id_index, old, new)
+        return None
+
+    def get_features(self) -> np.ndarray:
+        """Feature matrix of all rows (see features.py), cached next to the datafile."""
+        if self._features is not None:
+            return self._features
+        settings = dict(
+            version=featurelib.VERSION, size=8, nbins=8, vmin=self.vmin, vmax=self.vmax)
+        cache = FeatureCache(self.datafile, verbose=self.verbose)
+        images = self._images_fingerprint()
+        feats = cache.read(self._id_index, settings, images)
+        if feats is None:
+            with profiler.phase("features.compute"):
+                feats = featurelib.compute(
+                    self.get_imgs(np.arange(len(self.df))),
+                    size=settings["size"], nbins=settings["nbins"],
+                    vmin=self.vmin, vmax=self.vmax)
+            cache.write(self._id_index, settings, images, feats)
+        self._features = feats
+        return feats
+
+    @profiler.profile("select_similar")
+    def _select_similar(
+        self,
+        n: int,
+        exclude: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Unlabeled rows similar to a seed row, ordered by nearest-neighbour chaining.
+
+        The seed is random if `random`, else the first unlabeled row.
+        """
+        candidates = self._label_index.positions(self.label_null)
+        if exclude is not None and len(exclude) > 0:
+            candidates = candidates[~np.isin(candidates, exclude)]
+        if len(candidates) == 0:
+            return candidates
+        feats = self.get_features()
+        if self.random:
+            seed = candidates[self._rng.integers(len(candidates))]
+        else:
+            seed = candidates.min()
+        positions = featurelib.nearest(feats, candidates, seed, n)
+        start = np.flatnonzero(positions == seed)
+        return featurelib.chain(feats, positions, start=int(start[0]) if len(start) > 0 else 0)
+
+    @profiler.profile("model.fit")
+    def get_model(self) -> Optional[NearestCentroid]:
+        """Nearest-centroid model (see model.py) fitted on labelled rows
+        (at most MODEL_SAMPLES random rows per label). None if less than 2 labels are used."""
+        labels = [label for label in self.labels if self._label_index.count(label) > 0]
+        if len(labels) < 2:
+            return None
+        positions = [self._label_index.sample(label, MODEL_SAMPLES, rng=self._rng) for label in labels]
+        feats = self.get_features()
+        return NearestCentroid.fit(
+            np.concatenate([np.asarray(feats[np.sort(p)]) for p in positions]),
+            np.repeat(np.array(labels, dtype=object), [len(p) for p in positions]))
+
+    @profiler.profile("select_uncertain")
+    def _select_uncertain(
+        self,
+        model: NearestCentroid,
+        n: int,
+        exclude: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """`n` unlabeled rows whose predicted label is the least confident
+        (uncertainty sampling)."""
+        candidates = self._label_index.positions(self.label_null)
+        if exclude is not None and len(exclude) > 0:
+            candidates = candidates[~np.isin(candidates, exclude)]
+        if n >= len(candidates):
+            return candidates
+        candidates = np.sort(candidates)
+        _, confidence = model.predict(self.get_features(), candidates)
+        return candidates[np.argpartition(confidence, n)[:n]]
+
+    def get_render_cache(self) -> Optional[RenderCache]:
+        if self.cachedir is None:
+            return None
+        return RenderCache(
+            self.cachedir, size=self.cache_size, verbose=self.verbose)
+
+    def prune_cache(self) -> None:
+        cache = self.get_render_cache()
+        if cache is None:
+            warn("cachedir is not set")
+            return None
+        n_removed, n_bytes = cache.prune()
+        print(f"prune_cache: removed {n_removed} files ({n_bytes} bytes)")
+        return None
+
+    @profiler.profile("register")
     def register(
         self,
         save: bool = True,
@@ -343,75 +1066,419 @@ class Data(object):
             warn("Data is not loaded")
             return None
 
-        n_success = 0
-        n_failure = 0
         for labeldir in self.workdir.iterdir():
-            if labeldir.is_dir():
-                label = labeldir.name
-                if label not in self.labels:
-                    if self.verbose:
-                        print(f"Label '{label}' found")
-                    self.labels.append(label)
-        for label in self.labels:
-            filepaths = (self.workdir / label).glob(f"*{self.imgext}")
-            for filepath in filepaths:
-                name = filepath.name.rstrip(self.imgext)
-                if self._index_as_filename:
-                    idxs = [int(name)]
-                else:
-                    idxs = self.df[self.df[self.col_filename]==name].index
-                if len(idxs) == 0:
-                    warn(f"name '{name}' is not found")
-                    n_failure += 1
-                    continue
-
-                if self.verbose:
-                    print("data.register: label={} id={} idx={}".format(
-                        label, name, list(idxs)))
-                try:
-                    _ = self.df.loc[idxs, self.col_label]
-                except KeyError:
-                    warn(f"KeyError: idxs = {idxs}")
-                    n_failure += 1
-                    continue
+            if labeldir.is_dir() and not labeldir.name.startswith("."):
+                self._add_label(labeldir.name)
 
-                n_success += 1
-                self.df.loc[idxs, self.col_label] = label
+        with profiler.phase("register.scan"):
+            names, labels = self._scan_moved()
+        profiler.count("register.files", len(names))
+        n_success, n_failure, names, labels = self._register_names(names, labels)
+        profiler.count("register.changed", len(names))
 
         if save:
-            self.save(backup=backup)
+            if self.journal:
+                self._append_journal(names, labels)
+                self.workdir.clear(make_labeldirs=False)
+            else:
+                self.save(backup=backup)
+            if self.prefetch:
+                self._swap_prefetch()
 
         if self.verbose:
             print(f"data.register: n_success={n_success} n_failure={n_failure}")
         return (n_success, n_failure)
 
+    def _write_manifest(
+        self,
+        dirpath: Path,
+        filepaths: List[str],
+        renamed: Optional[dict] = None,
+        presorted: Optional[dict] = None,
+    ) -> None:
+        """Record deployed files (file name, id, top-level directory, inode).
+
+        Files are recorded where deploy planned them (`filepaths`), with the
+        inode at that path. A file which is no longer there (e.g. moved into a
+        label directory while rendering) is recorded with inode 0, so register
+        takes it as moved.
+
+        Presorted files are recorded in the workdir root, so register
+        takes them as moved into their label directory (confirmed) unless
+        they are moved back to the root.
+
+        Args:
+            filepaths (list): Planned file paths (under dirpath)
+            renamed (dict, optional): {file name: id} of files not named by id
+            presorted (dict, optional): {file name: label} of presorted files
+        """
+        renamed = dict() if renamed is None else renamed
+        presorted = dict() if presorted is None else presorted
+        n = len(self.imgext)
+        names = list()
+        topdirs = list()
+        inodes = list()
+        for filepath in filepaths:
+            relpath = Path(filepath).relative_to(dirpath)
+            name = relpath.name[:-n]
+            names.append(name)
+            topdirs.append(
+                "" if (len(relpath.parts) == 1 or name in presorted) else relpath.parts[0])
+            try:
+                inodes.append(os.stat(filepath).st_ino)
+            except FileNotFoundError:
+                inodes.append(0)
+        is_presorted = np.array([name in presorted for name in names], dtype=bool)
+        topdirs = np.array(topdirs, dtype=object)
+        dirs, codes = np.unique(topdirs.astype(str), return_inverse=True)
+        with (dirpath / DEPLOY_MANIFEST).open(mode="wb") as f:
+            np.savez(
+                f,
+                names=np.array(names, dtype=str),
+                ids=np.array([renamed.get(name, name) for name in names], dtype=str),
+                dirs=dirs,
+                codes=codes.astype(np.int32),
+                inodes=np.array(inodes, dtype=np.uint64),
+                presorted=is_presorted,
+            )
+        return None
+
+    def _manifest_ids(self) -> dict:
+        """{file name: id} of renamed files in the deploy manifest"""
+        manifestfile = self.workdir / DEPLOY_MANIFEST
+        if not manifestfile.is_file():
+            return dict()
+        with np.load(manifestfile, allow_pickle=False) as manifest:
+            names, ids = manifest["names"], manifest["ids"]
+            renamed = names != ids
+            return dict(zip(names[renamed].tolist(), ids[renamed].tolist()))
+
+    def _manifest_presorted(self) -> set:
+        """File names of presorted files in the deploy manifest"""
+        manifestfile = self.workdir / DEPLOY_MANIFEST
+        if not manifestfile.is_file():
+            return set()
+        with np.load(manifestfile, allow_pickle=False) as manifest:
+            if "presorted" not in manifest.files:
+                return set()
+            return set(manifest["names"][manifest["presorted"]].tolist())
+
+    def _scan_moved(self) -> Tuple[List[str], List[str]]:
+        """Files in label directories which are not where deploy put them.
+
+        Without a manifest, all files in label directories.
+
+        Returns:
+            tuple: (names, labels)
+        """
+        names, topdirs, inodes = scan_files(self.workdir, self.imgext)
+        names = np.array(names, dtype=object)
+        topdirs = np.array(topdirs, dtype=object)
+        target = (topdirs != "") & (names != MONTAGE_NAME)
+        manifestfile = self.workdir / DEPLOY_MANIFEST
+        if manifestfile.is_file() and len(names) > 0:
+            with np.load(manifestfile, allow_pickle=False) as manifest:
+                idx = pd.Index(manifest["names"]).get_indexer(names.astype(str))
+                known = idx >= 0
+                # file name -> id (e.g. sequence prefix of similarity order)
+                names[known] = manifest["ids"][idx[known]]
+                unchanged = np.zeros(len(names), dtype=bool)
+                unchanged[known] = (
+                    (manifest["dirs"][manifest["codes"][idx[known]]] == topdirs[known].astype(str))
+                    & (manifest["inodes"][idx[known]] == np.array(inodes, dtype=np.uint64)[known]))
+            target &= ~unchanged
+        return (list(names[target]), list(topdirs[target]))
+
+    def _add_label(self, label: str) -> None:
+        if label not in self.labels:
+            if self.verbose:
+                print(f"Label '{label}' found")
+            self.labels.append(label)
+        return None
+
+    def _register_names(
+        self,
+        names: List[str],
+        labels: List[str],
+    ) -> Tuple[int, int, np.ndarray, np.ndarray]:
+        """Set labels of files (ids) in label directories.
+
+        With `dedup`, the labels are also applied to unlabeled duplicates.
+
+        Returns:
+            tuple: (n_success, n_failure, ids whose label changed, their labels)
+        """
+        names = np.array(names, dtype=object)
+        labels = np.array(labels, dtype=object)
+        positions = self._get_positions(names)
+        found = positions >= 0
+        for name in names[~found]:
+            warn(f"name '{name}' is not found")
+        n_success = int(found.sum())
+        n_failure = int((~found).sum())
+
+        _changed = np.zeros(len(names), dtype=bool)
+        _changed[found] = (
+            self.df[self.col_label].to_numpy()[positions[found]] != labels[found])
+        for label in pd.unique(labels[found]):
+            _positions = positions[found & (labels == label)]
+            if self.verbose:
+                print(f"data.register: label={label} n={len(_positions)}")
+            self._set_labels(_positions, label)
+        names, labels = names[_changed], labels[_changed]
+        if self._dup_groups is not None and len(names) > 0:
+            dup_names, dup_labels = self._propagate_labels(positions[_changed], labels)
+            names = np.concatenate([names, dup_names])
+            labels = np.concatenate([labels, dup_labels])
+        return (n_success, n_failure, names, labels)
+
+    def _propagate_labels(
+        self,
+        positions: np.ndarray,
+        labels: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Set labels of unlabeled rows in the duplicate groups of `positions`.
+
+        Returns:
+            tuple: (ids, labels) of the propagated rows
+        """
+        names = list()
+        out = list()
+        for label in pd.unique(labels):
+            if label == self.label_null:
+                continue
+            members = self._dup_groups.members(positions[labels == label])
+            members = members[
+                self.df[self.col_label].to_numpy()[members] == self.label_null]
+            if len(members) == 0:
+                continue
+            if self.verbose:
+                print(f"data.register: label={label} n={len(members)} (duplicates)")
+            self._set_labels(members, label)
+            names.append(self._id_index[members].to_numpy(dtype=object))
+            out.append(np.full(len(members), label, dtype=object))
+        profiler.count("register.duplicates", sum(len(x) for x in names))
+        if len(names) == 0:
+            return (np.empty(0, dtype=object), np.empty(0, dtype=object))
+        return (np.concatenate(names), np.concatenate(out))
+
+    def watch(
+        self,
+        interval: Optional[float] = None,
+        save_interval: Optional[float] = None,
+        stop: Optional[threading.Event] = None,
+    ) -> Tuple[int, int]:
+        """Register files continuously as they are moved into label directories.
+
+        Labels are applied in memory at each poll and saved every
+        `save_interval` seconds (appended to the journal if `journal`),
+        and on exit (Ctrl+C or `stop`).
+
+        Args:
+            interval: Poll interval [s] (If None, self.watch_interval)
+            save_interval: Save interval [s] (If None, self.watch_save_interval)
+            stop: Event to stop watching
+
+        Returns:
+            tuple: (n_success, n_failure)
+        """
+        if not self.loaded:
+            warn("Data is not loaded")
+            return None
+        if interval is None:
+            interval = self.watch_interval
+        if save_interval is None:
+            save_interval = self.watch_save_interval
+        if stop is None:
+            stop = threading.Event()
+
+        watcher = LabelDirWatcher(
+            self.workdir, imgext=self.imgext, ignore=(MONTAGE_NAME,))
+        renamed = self._manifest_ids()
+        # presorted files are not labelled until moved (or confirmed by register)
+        presorted = self._manifest_presorted()
+        pending = dict()
+        n_success = 0
+        n_failure = 0
+        last_save = time.monotonic()
+
+        def _flush() -> None:
+            if len(pending) == 0:
+                return None
+            with profiler.phase("watch.save"):
+                if self.journal:
+                    self._append_journal(
+                        list(pending.keys()), list(pending.values()))
+                else:
+                    self.save(clear_workdir=False)
+            if self.verbose:
+                print(f"data.watch: saved {len(pending)} labels")
+            pending.clear()
+            return None
+
+        print(f"watch: {self.workdir} (Ctrl+C to stop)")
+        try:
+            while True:
+                names, labels = watcher.poll()
+                if len(presorted) > 0:
+                    # the first poll finds all files in label directories
+                    keep = [name not in presorted for name in names]
+                    names = [x for x, k in zip(names, keep) if k]
+                    labels = [x for x, k in zip(labels, keep) if k]
+                    presorted = set()
+                names = [renamed.get(name, name) for name in names]
+                if len(names) > 0:
+                    for label in set(labels):
+                        self._add_label(label)
+                    with profiler.phase("watch.register"):
+                        n_s, n_f, _names, _labels = self._register_names(names, labels)
+                    n_success += n_s
+                    n_failure += n_f
+                    for name, label in zip(_names, _labels):
+                        pending[name] = label
+                    if self.verbose:
+                        print(f"data.watch: {len(names)} files, {len(_names)} changed")
+                if time.monotonic() - last_save >= save_interval:
+                    _flush()
+                    last_save = time.monotonic()
+                if stop.wait(interval):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            _flush()
+        if self.verbose:
+            print(f"data.watch: n_success={n_success} n_failure={n_failure}")
+        return (n_success, n_failure)
+
+    def serve(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+    ) -> None:
+        """Serve the annotation page and JSON API (see server.py) until Ctrl+C.
+
+        Labels are saved every `watch_save_interval` seconds and on exit.
+        """
+        if not self.loaded:
+            warn("Data is not loaded")
+            return None
+        from .server import serve
+        serve(
+            self,
+            host=self.serve_host if host is None else host,
+            port=self.serve_port if port is None else port,
+            cache_size=self.serve_cache_size,
+            save_interval=self.watch_save_interval,
+        )
+        return None
+
+    @staticmethod
+    def export_statefile(filepath: Union[Path, str]) -> Path:
+        return Path(str(filepath) + ".state")
+
+    def _export_ids(self) -> pd.Index:
+        if self._index_as_filename:
+            return self.df.index
+        return pd.Index(self.df[self.col_filename])
+
+    @profiler.profile("export")
     def export(
         self,
         filepath: Union[Path, str],
         filetype: str = "csv",
-    ) -> None:
-        _df = pd.DataFrame(index=self.df.index)
-        if self._index_as_filename:
-            _df["id"] = self.df.index
-        else:
-            _df["id"] = self.df[self.col_filename]
-        _df["label"] = self.df[self.col_label]
+        incremental: bool = False,
+        chunksize: int = 100000,
+    ) -> int:
+        """Export labels (columns: df.index, id, label).
 
-        if filetype == "csv":
-            _df.to_csv(filepath, index=True)
-        else:
+        Rows are written in chunks of `chunksize` rows.
+        If `incremental`, only rows whose labels changed since the last export
+        are appended (the last row of an id wins). The labels of the last
+        export are kept in `<filepath>.state`; if the state or the export
+        does not match, all rows are exported.
+
+        Returns:
+            int: Number of exported rows
+        """
+        if filetype != "csv":
             raise ValueError("filetype must be in ['csv']")
+        filepath = Path(filepath)
+        statefile = self.export_statefile(filepath)
+        labels = self._copy_labels()
+
+        positions = None
+        if incremental and filepath.is_file() and statefile.is_file():
+            with gzip.open(statefile, mode="rb") as f:
+                state = pickle.load(f)
+            if state.get("size") == filepath.stat().st_size:
+                prev = pd.Series(state["labels"], index=state["ids"])
+                prev = prev.reindex(self._id_index).to_numpy(dtype=object)
+                positions = np.flatnonzero(labels != prev)
+
+        ids = self._export_ids()
+        index = self.df.index
+        col_label = self.df[self.col_label]
+        if positions is None:
+            positions = np.arange(len(self.df))
+            mode, header = "w", True
+        else:
+            mode, header = "a", False
+        with filepath.open(mode=mode, newline="") as f:
+            for i in range(0, max(len(positions), 1), chunksize):
+                pos = positions[i:i+chunksize]
+                if len(pos) == 0 and not header:
+                    break
+                _df = pd.DataFrame(
+                    dict(id=ids[pos], label=col_label.iloc[pos].to_numpy()),
+                    index=index[pos])
+                _df.to_csv(f, index=True, header=header)
+                header = False
+
+        if incremental:
+            tmpfile = Path(str(statefile) + ".tmp")
+            with gzip.open(tmpfile, mode="wb") as f:
+                pickle.dump(dict(
+                    size=filepath.stat().st_size,
+                    ids=self._id_index.to_numpy(),
+                    labels=labels,
+                ), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpfile, statefile)
+        elif statefile.is_file():
+            statefile.unlink()
+        profiler.count("export.rows", len(positions))
         if self.verbose:
-            print(f"data.export: {filepath}")
-        return None
+            print(f"data.export: {filepath} ({len(positions)} rows)")
+        return len(positions)
+
+    @staticmethod
+    def _read_pickle(
+        filepath: Union[Path, str],
+        workers: int = 1,
+    ) -> pd.DataFrame:
+        with open(filepath, mode="rb") as f:
+            codec = compressionlib.detect(f.read(6))
+        codec_ext = compressionlib.infer(filepath)
+        if codec == "none":
+            return pd.read_pickle(
+                filepath, compression="infer" if codec_ext == "none" else None)
+        if workers <= 1 and codec == codec_ext:
+            return pd.read_pickle(filepath)
+
+        data = compressionlib.decompress(Path(filepath).read_bytes(), workers=workers)
+        return pd.read_pickle(io.BytesIO(data), compression=None)
 
     @staticmethod
+    @profiler.profile("save.pickle")
     def _save_pickle(
         df: pd.DataFrame,
         filepath: Union[Path, str],
         backup: bool = True,
         backup_suffix: str = "~",
         verbose: bool = False,
+        compression: Optional[str] = None,
+        compresslevel: Optional[int] = None,
+        workers: int = 1,
     ) -> None:
         s_filepath = str(filepath)
         if backup and Path(filepath).is_file():
@@ -423,23 +1490,123 @@ class Data(object):
         if verbose:
             print(f"data.save: {s_filepath}")
 
-        df.to_pickle(filepath)
+        if compression is None:
+            if Path(filepath).suffix.lower() in (".zip", ".zst", ".tar"):
+                df.to_pickle(filepath)
+                return None
+            compression = compressionlib.infer(filepath)
+        with profiler.phase("save.serialize"):
+            data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        with profiler.phase("save.compress"):
+            data = compressionlib.compress(
+                data,
+                codec=compression,
+                level=compresslevel,
+                workers=workers,
+            )
+        with profiler.phase("save.write"):
+            s_filepath_tmp = s_filepath + ".tmp"
+            with open(s_filepath_tmp, mode="wb") as f:
+                f.write(data)
+            os.replace(s_filepath_tmp, s_filepath)
+        return None
+
+    @property
+    def backupdir(self) -> Path:
+        return Path(str(self.datafile) + ".backup")
+
+    def _backup_labels(self, generations: int = 1) -> None:
+        labels = self.df[self.col_label].to_numpy(dtype=object)
+        changed = labels != self._saved_labels
+        if not changed.any():
+            return None
+        LabelBackup(self.backupdir, verbose=self.verbose).write(
+            ids=list(self._id_index[changed]),
+            labels=list(self._saved_labels[changed]),
+            generations=generations,
+        )
+        return None
+
+    def restore(self, generation: int = 1) -> None:
+        """Restore labels to the state before the `generation`-th latest save."""
+        if not self.loaded:
+            warn("Data is not loaded")
+            return None
+        generations = LabelBackup(self.backupdir).generations()
+        if not (1 <= generation <= len(generations)):
+            raise ValueError(
+                f"generation must be in 1..{len(generations)} ({self.backupdir})")
+
+        if self.journalfile.is_file():
+            # fold the journal first (its entries become the newest generation,
+            # so `restore(1)` after this restore brings them back)
+            print(f"restore: compact {self.journalfile}")
+            n_generations = len(generations)
+            self.save(backup=n_generations + 1, clear_workdir=False)
+            generations = LabelBackup(self.backupdir).generations()
+            generation += len(generations) - n_generations
+
+        # undo saves (newest first)
+        self.df[self.col_label] = self._saved_labels.copy()
+        self._build_label_index()
+        for filepath in generations[:generation]:
+            ids, labels = LabelBackup.read(filepath)
+            self._set_labels_by_ids(ids, labels, context="Restore")
+        print(f"restore: {generations[generation-1].name}")
+        self.save(clear_workdir=False)
         return None
 
-    def save(self, backup: Optional[bool] = None) -> None:
+    @profiler.profile("save")
+    def save(
+        self,
+        backup: Optional[int] = None,
+        clear_workdir: bool = True,
+    ) -> None:
+        """
+        Args:
+            backup: Number of label backup generations (If None, self.backup)
+            clear_workdir: If True, clear workdir after save
+        """
         if not self.loaded:
             warn("Data is not loaded")
             return None
 
         if backup is None:
             backup = self.backup
+        if backup:
+            with profiler.phase("save.backup"):
+                self._backup_labels(generations=int(backup))
+        loadcache = self.get_load_cache()
+        if loadcache is not None:
+            loadcache.invalidate(self.datafile)
+        images = self._images_fingerprint() if Path(self.datafile).is_file() else None
         self._save_pickle(
             df=self.df,
             filepath=self.datafile,
-            backup=backup,
-            verbose=self.verbose
+            backup=False,
+            verbose=self.verbose,
+            compression=self.compression,
+            compresslevel=self.compresslevel,
+            workers=self.n_workers,
         )
-        self.workdir.clear(make_labeldirs=False)
+        if loadcache is not None:
+            loadcache.write(self.datafile, self.df)
+        if images is not None:
+            self._refresh_image_caches(images)
+        self._saved_labels = self._copy_labels()
+        # journal is folded into the datafile
+        if self.journalfile.is_file():
+            self.journalfile.unlink()
+        if clear_workdir:
+            self.workdir.clear(make_labeldirs=False)
+        return None
+
+    def compact(self, backup: Optional[bool] = None) -> None:
+        """Fold the label journal into the datafile."""
+        if not self.journalfile.is_file():
+            print(f"compact: {self.journalfile} not found")
+            return None
+        self.save(backup=backup, clear_workdir=False)
         return None
 
     def create_sample_datafile(
@@ -464,5 +1631,8 @@ class Data(object):
             filepath=filepath,
             backup=backup,
             verbose=self.verbose,
+            compression=self.compression,
+            compresslevel=self.compresslevel,
+            workers=self.n_workers,
         )
         return None
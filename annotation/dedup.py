@@ -0,0 +1,191 @@
+"""Duplicate and near-duplicate image groups
+
+- exact: hash of image bytes (dtype, shape, values)
+- perceptual: block means (area downsampling) of the image normalized to its
+  value range, quantized to `levels` levels, together with the number of
+  defect pixels (upper half of the value range). The smallest hash over the
+  8 rotations/flips is used, so rotated or flipped copies get the same hash.
+
+Exact duplicates are labelled together; near-duplicates (perceptual) are
+only suggested (see `Data._plan_deploy`).
+
+Hashes are cached in `<datafile>.dedup.npz` (valid while the ids and the
+fingerprint of the images (see `Data._images_fingerprint`) are unchanged).
+"""
+import hashlib
+from pathlib import Path
+from typing import Union, Optional, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .features import FeatureCache
+
+
+EXACT = 1
+PERCEPTUAL = 2
+# version of the hashes (cache key)
+VERSION = 2
+
+
+def exact_hashes(imgs: List[np.ndarray]) -> np.ndarray:
+    """(n,) uint64 content hashes"""
+    hashes = np.empty(len(imgs), dtype=np.uint64)
+    for i, m in enumerate(imgs):
+        m = np.ascontiguousarray(m)
+        h = hashlib.blake2b(digest_size=8)
+        h.update(f"{m.dtype.str}{m.shape}".encode())
+        h.update(m.data)
+        hashes[i] = int.from_bytes(h.digest(), "little")
+    return hashes
+
+
+def _block_means(x: np.ndarray, size: int) -> np.ndarray:
+    """(k, h, w) -> (k, size, size) means of (almost) equal blocks"""
+    _, h, w = x.shape
+    rows = np.arange(min(size, h)) * h // min(size, h)
+    cols = np.arange(min(size, w)) * w // min(size, w)
+    sums = np.add.reduceat(np.add.reduceat(x, rows, axis=1), cols, axis=2)
+    areas = np.outer(np.diff(np.append(rows, h)), np.diff(np.append(cols, w)))
+    return sums / areas
+
+
+def perceptual_hashes(
+    imgs: List[np.ndarray],
+    size: int = 8,
+    levels: int = 16,
+) -> np.ndarray:
+    """(n,) uint64 rotation/flip invariant hashes"""
+    hashes = np.zeros(len(imgs), dtype=np.uint64)
+    groups = dict()
+    for i, m in enumerate(imgs):
+        groups.setdefault(np.shape(m), list()).append(i)
+    for shape, idxs in groups.items():
+        idxs = np.asarray(idxs)
+        if len(shape) != 2 or 0 in shape:
+            continue
+        x = np.stack([np.asarray(imgs[i], dtype=np.float32) for i in idxs])
+        x = np.nan_to_num(x, nan=0.0)
+        lo = x.min(axis=(1, 2), keepdims=True)
+        hi = x.max(axis=(1, 2), keepdims=True)
+        x = (x - lo) / np.maximum(hi - lo, 1e-9)
+        n_defects = (x > 0.5).sum(axis=(1, 2))
+
+        # transform the image, then downsample (blocks need not be symmetric)
+        best = None
+        for flip in (False, True):
+            v = x[:, :, ::-1] if flip else x
+            for k in range(4):
+                q = np.rint(_block_means(np.rot90(v, k, axes=(1, 2)), size) * (levels - 1))
+                cells = pd.DataFrame(q.reshape(len(idxs), -1).astype(np.int64))
+                cells["n_defects"] = n_defects
+                code = pd.util.hash_pandas_object(cells, index=False).to_numpy()
+                best = code if best is None else np.minimum(best, code)
+        hashes[idxs] = best
+    return hashes
+
+
+def group_codes(hashes: np.ndarray) -> np.ndarray:
+    """Group code of each row (rows with equal hashes share a code)."""
+    if hashes.ndim == 1:
+        codes, _ = pd.factorize(hashes)
+    else:
+        _, codes = np.unique(hashes, axis=0, return_inverse=True)
+    return np.asarray(codes, dtype=np.int64).ravel()
+
+
+class DuplicateGroups(object):
+    """Rows grouped by hash (members of each group via one argsort)."""
+    def __init__(self, codes: np.ndarray) -> None:
+        self.codes = codes
+        self.order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes) if len(codes) > 0 else np.zeros(0, dtype=np.int64)
+        self.starts = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.starts[1:])
+        self.sizes = counts
+        return None
+
+    @property
+    def n_duplicates(self) -> int:
+        """Number of rows which are not the first of their group"""
+        return int(len(self.codes) - len(self.sizes))
+
+    def members(self, positions: np.ndarray) -> np.ndarray:
+        """All rows in the groups of `positions` (including themselves)."""
+        groups = np.unique(self.codes[positions])
+        groups = groups[self.sizes[groups] > 1]
+        if len(groups) == 0:
+            return np.asarray(positions, dtype=np.int64)
+        parts = [self.order[self.starts[g]:self.starts[g+1]] for g in groups]
+        return np.unique(np.concatenate([np.asarray(positions, dtype=np.int64)] + parts))
+
+    def non_representatives(self, candidates: np.ndarray) -> np.ndarray:
+        """Candidates which are not the first candidate (by row) of their group."""
+        candidates = np.sort(candidates)
+        _, first = np.unique(self.codes[candidates], return_index=True)
+        mask = np.ones(len(candidates), dtype=bool)
+        mask[first] = False
+        return candidates[mask]
+
+
+def _cachefile(datafile: Union[Path, str]) -> Path:
+    return Path(str(datafile) + ".dedup.npz")
+
+
+def _key(ids: pd.Index, images: str) -> str:
+    return f"{VERSION}:{FeatureCache.ids_hash(ids)}:{images}"
+
+
+def read_or_compute(
+    datafile: Union[Path, str],
+    ids: pd.Index,
+    images: str,
+    imgs,
+    perceptual: bool = False,
+    verbose: bool = False,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Group codes of rows (hashes cached in `<datafile>.dedup.npz`).
+
+    Args:
+        images (str): Fingerprint of the images
+        imgs (callable): Returns all images (called only if not cached)
+        perceptual (bool): Also group near-duplicates
+
+    Returns:
+        tuple: (exact group codes, perceptual group codes (None if not perceptual))
+    """
+    cachefile = _cachefile(datafile)
+    key = _key(ids, images)
+    hashes = dict()
+    if cachefile.is_file():
+        with np.load(cachefile, allow_pickle=False) as f:
+            if str(f["key"]) == key:
+                hashes = {k: f[k] for k in ("exact", "perceptual") if k in f.files}
+    missing = [k for k in ("exact", "perceptual")
+               if k not in hashes and (k == "exact" or perceptual)]
+    if len(missing) > 0:
+        _imgs = imgs()
+        for k in missing:
+            hashes[k] = exact_hashes(_imgs) if k == "exact" else perceptual_hashes(_imgs)
+        with cachefile.open(mode="wb") as f:
+            np.savez(f, key=np.array(key), **hashes)
+        if verbose:
+            print(f"dedup: write {cachefile}")
+    return (
+        group_codes(hashes["exact"]),
+        group_codes(hashes["perceptual"]) if perceptual else None,
+    )
+
+
+def refresh(datafile: Union[Path, str], ids: pd.Index, old: str, new: str) -> None:
+    """Keep the cache valid after the datafile is rewritten with the same images."""
+    cachefile = _cachefile(datafile)
+    if not cachefile.is_file():
+        return None
+    with np.load(cachefile, allow_pickle=False) as f:
+        if str(f["key"]) != _key(ids, old):
+            return None
+        hashes = {k: f[k] for k in ("exact", "perceptual") if k in f.files}
+    with cachefile.open(mode="wb") as f:
+        np.savez(f, key=np.array(_key(ids, new)), **hashes)
+    return None
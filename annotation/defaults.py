@@ -0,0 +1,107 @@
+"""Configuration defaults and type conversion
+
+Kept free of heavy imports (pandas, matplotlib, ...) so that the CLI
+can parse arguments and write config files quickly.
+"""
+from pathlib import Path
+
+
+CONFIG_DEFAULT = dict(
+    # NOTE: values must be int or float or str
+    datafile = "./data.pkl.xz",
+    workdir = "./work",
+    cmapfile = "",
+    n = 30,
+    n_example = 5,
+    col_filename = "id",
+    col_img = "img",
+    col_label = "label",
+    labels = "none",
+    label_null = "",
+    random = 1,
+    similar = 0,
+    dedup = 0,
+    uncertain = 0,
+    presort = "",
+    imgext = ".png",
+    cmap = "",
+    vmin = 0.0,
+    vmax = 1.0,
+    figsize = "4,4",
+    renderer = "seaborn",
+    montage = 0,
+    shard = 0,
+    prefetch = 0,
+    discrete = "",
+    workers = 1,
+    worker_maxtasks = 100,
+    cachedir = "",
+    cache_size = 1024.0,
+    loadcache = "",
+    compression = "",
+    compresslevel = "",
+    fastclear = 0,
+    journal = 0,
+    watch_interval = 1.0,
+    watch_save_interval = 60.0,
+    serve_host = "127.0.0.1",
+    serve_port = 8000,
+    serve_cache_size = 256.0,
+    backup = 1,
+    verbose = 0,
+)
+
+
+class Config(dict):
+    def conv(self) -> None:
+        for k in self.keys():
+            # Optional
+            if k in ["cmapfile", "cmap", "n", "n_example", "vmin", "vmax", "worker_maxtasks",
+                     "cachedir", "cache_size", "loadcache",
+                     "compression", "compresslevel", "discrete", "serve_cache_size", "presort"]:
+                if self[k] == "":
+                    self[k] = None
+            if self[k] is None:
+                pass
+            else:
+                # bool
+                if k in ["random", "similar", "uncertain", "montage", "prefetch", "fastclear", "journal", "verbose"]:
+                    self[k] = bool(int(self[k]))
+                # int
+                if k in ["n", "n_example", "workers", "worker_maxtasks", "compresslevel",
+                         "backup", "serve_port", "shard", "dedup"]:
+                    self[k] = int(self[k])
+                # float
+                if k in ["vmin", "vmax", "cache_size", "watch_interval", "watch_save_interval",
+                         "serve_cache_size", "presort"]:
+                    self[k] = float(self[k])
+                # list(separator=",")
+                if k in ["labels", "figsize"]:
+                    if self[k] == "":
+                        self[k] = list()
+                    else:
+                        self[k] = self[k].split(",")
+                # list[float]
+                if k in ["figsize"]:
+                    self[k] = [float(x) for x in self[k]]
+                # "auto" or list[float]
+                if k in ["discrete"] and self[k] != "auto":
+                    if type(self[k]) is not list:
+                        self[k] = str(self[k]).split(",")
+                    self[k] = [float(x) for x in self[k]]
+                # Path
+                if k in ["cmapfile", "datafile", "cachedir", "loadcache"]:
+                    self[k] = Path(self[k])
+        return None
+
+    def conv_to_str(self) -> None:
+        for k, v in self.items():
+            if v is None:
+                self[k] = ""
+            elif type(v) is bool:
+                self[k] = str(int(v))
+            elif type(v) is list:
+                self[k] = ",".join([str(x) for x in v])
+            else:
+                self[k] = str(v)
+        return None
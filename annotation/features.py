@@ -0,0 +1,208 @@
+"""Per-image feature vectors for similarity ordering
+
+Features (float32, computed with NumPy over all images of the same shape at once):
+- the image resampled (nearest) to `size` x `size`, normalized to [0, 1]
+- radial histogram of defects (fraction of defect pixels in `nbins` rings)
+- angular histogram of defects (fraction of defect pixels in `nbins` sectors)
+- defect density
+
+"Defect" pixels are pixels in the upper half of the value range
+(value 2 of WM-811K wafer maps with vmin=0, vmax=2 or per-image range).
+
+Features are cached in a sidecar file next to the datafile:
+- `<datafile>.features.npy`: (n_rows, n_features) float32 (opened with mmap)
+- `<datafile>.features.json`: settings, a hash of the ids and a fingerprint
+  of the images (see `Data._images_fingerprint`)
+"""
+import json
+import hashlib
+from pathlib import Path
+from typing import Union, Optional, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+VERSION = 1
+
+
+def _grid(shape: Tuple[int, int], size: int) -> Tuple[np.ndarray, np.ndarray]:
+    h, w = shape
+    rows = np.minimum((np.arange(size) + 0.5) * h / size, h - 1).astype(np.intp)
+    cols = np.minimum((np.arange(size) + 0.5) * w / size, w - 1).astype(np.intp)
+    return rows, cols
+
+
+def _bins(shape: Tuple[int, int], nbins: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Ring and sector index of each pixel."""
+    h, w = shape
+    yy, xx = np.mgrid[:h, :w]
+    dy = yy - (h - 1) / 2
+    dx = xx - (w - 1) / 2
+    r = np.sqrt(dy ** 2 + dx ** 2)
+    r = r / max(r.max(), 1e-9)
+    ring = np.minimum((r * nbins).astype(np.intp), nbins - 1)
+    angle = (np.arctan2(dy, dx) + np.pi) / (2 * np.pi)
+    sector = np.minimum((angle * nbins).astype(np.intp), nbins - 1)
+    return ring.ravel(), sector.ravel()
+
+
+def n_features(size: int = 8, nbins: int = 8) -> int:
+    return size * size + 2 * nbins + 1
+
+
+def compute(
+    imgs: List[np.ndarray],
+    size: int = 8,
+    nbins: int = 8,
+    vmin: Optional[float] = None,
+    vmax: Optional[float] = None,
+) -> np.ndarray:
+    """Compute features of images.
+
+    Args:
+        imgs (list): 2d images
+        size (int, optional): Side length of resampled image
+        nbins (int, optional): Number of radial/angular bins
+        vmin (float, optional): Value range (If None, min of each image)
+        vmax (float, optional): Value range (If None, max of each image)
+
+    Returns:
+        numpy.ndarray: (len(imgs), n_features) float32
+    """
+    feats = np.zeros((len(imgs), n_features(size, nbins)), dtype=np.float32)
+    groups = dict()
+    for i, m in enumerate(imgs):
+        groups.setdefault(np.shape(m), list()).append(i)
+    for shape, idxs in groups.items():
+        idxs = np.asarray(idxs)
+        if len(shape) != 2 or 0 in shape:
+            continue
+        x = np.stack([np.asarray(imgs[i], dtype=np.float32) for i in idxs])
+        x = np.nan_to_num(x, nan=0.0)
+        lo = x.min(axis=(1, 2), keepdims=True) if vmin is None else np.float32(vmin)
+        hi = x.max(axis=(1, 2), keepdims=True) if vmax is None else np.float32(vmax)
+        x = np.clip((x - lo) / np.maximum(hi - lo, 1e-9), 0, 1)
+        defect = (x > 0.5).reshape(len(idxs), -1).astype(np.float32)
+
+        rows, cols = _grid(shape, size)
+        ring, sector = _bins(shape, nbins)
+        n_ring = np.maximum(np.bincount(ring, minlength=nbins), 1)
+        n_sector = np.maximum(np.bincount(sector, minlength=nbins), 1)
+        # (pixels, bins) one-hot matrices: histograms of all images in one matmul
+        ring_onehot = np.eye(nbins, dtype=np.float32)[ring] / n_ring
+        sector_onehot = np.eye(nbins, dtype=np.float32)[sector] / n_sector
+
+        f = feats[idxs]
+        f[:, :size * size] = x[:, rows][:, :, cols].reshape(len(idxs), -1)
+        f[:, size * size:size * size + nbins] = defect @ ring_onehot
+        f[:, size * size + nbins:-1] = defect @ sector_onehot
+        f[:, -1] = defect.mean(axis=1)
+        feats[idxs] = f
+    return feats
+
+
+def nearest(
+    feats: np.ndarray,
+    candidates: np.ndarray,
+    seed: int,
+    n: int,
+    chunksize: int = 65536,
+) -> np.ndarray:
+    """`n` candidates nearest to `seed` (row positions, unordered)."""
+    center = np.asarray(feats[seed], dtype=np.float32)
+    dist = np.empty(len(candidates), dtype=np.float32)
+    for i in range(0, len(candidates), chunksize):
+        chunk = np.asarray(feats[candidates[i:i+chunksize]], dtype=np.float32)
+        dist[i:i+chunksize] = ((chunk - center) ** 2).sum(axis=1)
+    if n < len(candidates):
+        return candidates[np.argpartition(dist, n)[:n]]
+    return candidates
+
+
+def chain(feats: np.ndarray, positions: np.ndarray, start: int = 0) -> np.ndarray:
+    """Order rows by nearest-neighbour chaining (each next row is the
+    nearest unvisited row to the current one)."""
+    if len(positions) <= 2:
+        return positions
+    x = np.asarray(feats[positions], dtype=np.float32)
+    sq = (x ** 2).sum(axis=1)
+    dist = sq[:, None] + sq[None, :] - 2 * (x @ x.T)
+    order = [start]
+    visited = np.zeros(len(positions), dtype=bool)
+    visited[start] = True
+    for _ in range(len(positions) - 1):
+        d = np.where(visited, np.inf, dist[order[-1]])
+        i = int(np.argmin(d))
+        order.append(i)
+        visited[i] = True
+    return positions[order]
+
+
+class FeatureCache(object):
+    def __init__(self, datafile: Union[Path, str], verbose: bool = False) -> None:
+        self.datafile = Path(datafile)
+        self.verbose = verbose
+        return None
+
+    def paths(self) -> Tuple[Path, Path]:
+        base = str(self.datafile) + ".features"
+        return (Path(base + ".npy"), Path(base + ".json"))
+
+    @staticmethod
+    def ids_hash(ids: pd.Index) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        h.update("\0".join(ids.astype(str)).encode())
+        return h.hexdigest()
+
+    def _read_meta(self) -> Optional[dict]:
+        _, metafile = self.paths()
+        try:
+            with metafile.open(mode="r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read(self, ids: pd.Index, settings: dict, images: str) -> Optional[np.ndarray]:
+        """Cached features (memory-mapped; None if missing or stale).
+
+        Args:
+            images (str): Fingerprint of the images
+        """
+        featurefile, metafile = self.paths()
+        if not (featurefile.is_file() and metafile.is_file()):
+            return None
+        meta = self._read_meta()
+        if meta is None:
+            return None
+        if (meta.get("settings") != settings or meta.get("images") != images
+                or meta.get("ids") != self.ids_hash(ids)):
+            return None
+        feats = np.load(featurefile, mmap_mode="r")
+        if len(feats) != len(ids):
+            return None
+        if self.verbose:
+            print(f"features: {featurefile}")
+        return feats
+
+    def write(self, ids: pd.Index, settings: dict, images: str, feats: np.ndarray) -> None:
+        featurefile, metafile = self.paths()
+        if metafile.is_file():
+            metafile.unlink()
+        with featurefile.open(mode="wb") as f:
+            np.save(f, feats)
+        with metafile.open(mode="w") as f:
+            json.dump(dict(settings=settings, ids=self.ids_hash(ids), images=images), f)
+        if self.verbose:
+            print(f"features: write {featurefile}")
+        return None
+
+    def refresh(self, old: str, new: str) -> None:
+        """Keep the cache valid after the datafile is rewritten with the same images."""
+        meta = self._read_meta()
+        if meta is None or meta.get("images") != old:
+            return None
+        meta["images"] = new
+        with self.paths()[1].open(mode="w") as f:
+            json.dump(meta, f)
+        return None
@@ -1,3 +1,3 @@
-__version__ = "1.7.0"
+__version__ = "1.8.0"
 APPNAME = f"Annotation tool v{__version__}"
 GITHUB = "https://github.com/kihiyuki/annotation/"
@@ -0,0 +1,96 @@
+"""Label -> row positions index
+
+Each label keeps an array of the row positions that have the label
+(unordered, with spare capacity), and each row keeps its slot in that array.
+A label change is a swap-remove from the old array and an append to the new
+one, so counting is O(1) and sampling k rows of a label is O(k).
+"""
+from typing import Optional, Dict
+
+import numpy as np
+import pandas as pd
+
+
+class LabelIndex(object):
+    def __init__(self, labels: np.ndarray) -> None:
+        """
+        Args:
+            labels (numpy.ndarray): Label of each row
+        """
+        codes, uniques = pd.factorize(np.asarray(labels, dtype=object))
+        self._codes = codes.astype(np.int64)
+        self._slots = np.empty(len(codes), dtype=np.int64)
+        self._code: Dict[str, int] = {label: i for i, label in enumerate(uniques)}
+        self._rows = list()
+        self._sizes = list()
+
+        order = np.argsort(self._codes, kind="stable")
+        counts = np.bincount(self._codes, minlength=len(uniques))
+        starts = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=starts[1:])
+        for i in range(len(counts)):
+            rows = order[starts[i]:starts[i+1]].astype(np.int64)
+            self._slots[rows] = np.arange(len(rows))
+            self._rows.append(rows)
+            self._sizes.append(len(rows))
+        return None
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def count(self, label: str) -> int:
+        code = self._code.get(label)
+        return 0 if code is None else self._sizes[code]
+
+    def positions(self, label: str) -> np.ndarray:
+        """Row positions of a label (unordered)"""
+        code = self._code.get(label)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        return self._rows[code][:self._sizes[code]].copy()
+
+    def sample(
+        self,
+        label: str,
+        n: int,
+        rng: Optional[np.random.Generator] = None,
+    ) -> np.ndarray:
+        """Random row positions of a label (at most n, without replacement)"""
+        code = self._code.get(label)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        if rng is None:
+            rng = np.random.default_rng()
+        size = self._sizes[code]
+        picked = rng.choice(size, size=min(n, size), replace=False)
+        return self._rows[code][picked]
+
+    def move(self, positions: np.ndarray, label: str) -> None:
+        """Change the label of rows."""
+        code = self._code.get(label)
+        if code is None:
+            code = self._code[label] = len(self._rows)
+            self._rows.append(np.empty(max(16, len(positions)), dtype=np.int64))
+            self._sizes.append(0)
+        codes, slots, rows_, sizes = self._codes, self._slots, self._rows, self._sizes
+        for row in np.asarray(positions, dtype=np.int64).tolist():
+            old = codes[row]
+            if old == code:
+                continue
+            # swap-remove from the old label
+            rows = rows_[old]
+            last = sizes[old] - 1
+            slot = slots[row]
+            moved = rows[last]
+            rows[slot] = moved
+            slots[moved] = slot
+            sizes[old] = last
+            # append to the new label
+            rows = rows_[code]
+            if sizes[code] == len(rows):
+                rows = rows_[code] = np.concatenate([rows, np.empty(len(rows), dtype=np.int64)])
+            rows[sizes[code]] = row
+            slots[row] = sizes[code]
+            sizes[code] += 1
+            codes[row] = code
+        return None
@@ -1,11 +1,14 @@
 import shutil
+import struct
+import zlib
+import lzma
+import bz2
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser, DEFAULTSECT
 from random import choices
 from string import ascii_letters, digits
 from pathlib import Path
-from typing import Optional, Union
-
-import numpy as np
+from typing import Optional, Union, List, Tuple
 
 
 class ConfigData(dict):
@@ -193,12 +196,184 @@ class config(object):
         shutil.copyfile(file, file_back)
 
 
+class compression(object):
+    """Multi-stream (parallel) compression
+
+    Data is split into chunks, and each chunk is compressed in parallel
+    as an independent stream (xz stream, gzip member, bz2 stream).
+    Concatenated streams are readable by standard tools.
+    """
+    CODECS = ("xz", "gzip", "bz2", "none")
+    EXTENSIONS = {".xz": "xz", ".gz": "gzip", ".bz2": "bz2"}
+    CHUNKSIZE = 1 << 24
+
+    # gzip FEXTRA subfield holding the member size (for parallel decompression)
+    _GZIP_SUBFIELD = b"AN"
+
+    def __init__(self) -> None:
+        pass
+
+    @staticmethod
+    def infer(file: Union[str, Path]) -> str:
+        """Infer codec from file extension."""
+        return compression.EXTENSIONS.get(Path(file).suffix.lower(), "none")
+
+    @staticmethod
+    def detect(data: bytes) -> str:
+        """Detect codec from magic bytes."""
+        if data[:6] == b"\xfd7zXZ\x00":
+            return "xz"
+        elif data[:2] == b"\x1f\x8b":
+            return "gzip"
+        elif data[:3] == b"BZh":
+            return "bz2"
+        return "none"
+
+    @staticmethod
+    def _gzip_member(chunk: bytes, level: int) -> bytes:
+        c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = c.compress(chunk) + c.flush()
+        trailer = struct.pack("<II", zlib.crc32(chunk) & 0xffffffff, len(chunk) & 0xffffffff)
+        # header(10) + XLEN(2) + subfield(4+8) + body + trailer(8)
+        size = 10 + 2 + 12 + len(body) + 8
+        header = (
+            b"\x1f\x8b\x08\x04" + b"\x00\x00\x00\x00" + b"\x00\xff"
+            + struct.pack("<H", 12)
+            + compression._GZIP_SUBFIELD + struct.pack("<HQ", 8, size)
+        )
+        return header + body + trailer
+
+    @staticmethod
+    def compress(
+        data: bytes,
+        codec: str = "xz",
+        level: Optional[int] = None,
+        workers: int = 1,
+        chunksize: Optional[int] = None,
+    ) -> bytes:
+        """Compress data as multiple streams.
+
+        Args:
+            data (bytes): Data
+            codec (str, optional): 'xz', 'gzip', 'bz2', 'none'
+            level (int, optional): Preset/compresslevel (If None, codec default)
+            workers (int, optional): Number of threads
+            chunksize (int, optional): Uncompressed size of each stream
+
+        Returns:
+            bytes
+        """
+        if codec == "none":
+            return data
+        elif codec == "xz":
+            func = lambda x: lzma.compress(x, preset=level)
+        elif codec == "gzip":
+            func = lambda x: compression._gzip_member(x, 9 if level is None else level)
+        elif codec == "bz2":
+            func = lambda x: bz2.compress(x, 9 if level is None else level)
+        else:
+            raise ValueError(f"codec must be in {list(compression.CODECS)}")
+
+        if chunksize is None:
+            chunksize = compression.CHUNKSIZE
+        view = memoryview(data)
+        chunks = [view[i:i+chunksize] for i in range(0, max(len(data), 1), chunksize)]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return b"".join(executor.map(func, chunks))
+
+    @staticmethod
+    def _varint(data: bytes, p: int) -> Tuple[int, int]:
+        value = 0
+        for i in range(9):
+            b = data[p]
+            p += 1
+            value |= (b & 0x7f) << (7 * i)
+            if b & 0x80 == 0:
+                break
+        return value, p
+
+    @staticmethod
+    def _xz_streams(data: bytes) -> Optional[List[Tuple[int, int]]]:
+        """Stream boundaries of .xz (walking backwards from stream footers)."""
+        streams = list()
+        end = len(data)
+        while end > 0:
+            # stream padding
+            while end >= 4 and data[end-4:end] == b"\x00\x00\x00\x00":
+                end -= 4
+            if end == 0:
+                break
+            if end < 32 or data[end-2:end] != b"YZ":
+                return None
+            backward_size = (struct.unpack("<I", data[end-8:end-4])[0] + 1) * 4
+            p = end - 12 - backward_size
+            if p < 12 or data[p] != 0:
+                return None
+            n_records, p = compression._varint(data, p + 1)
+            blocks_size = 0
+            for _ in range(n_records):
+                unpadded_size, p = compression._varint(data, p)
+                _, p = compression._varint(data, p)
+                blocks_size += -(-unpadded_size // 4) * 4
+            start = end - 12 - backward_size - blocks_size - 12
+            if start < 0 or data[start:start+6] != b"\xfd7zXZ\x00":
+                return None
+            streams.append((start, end))
+            end = start
+        return streams[::-1]
+
+    @staticmethod
+    def _gzip_members(data: bytes) -> Optional[List[Tuple[int, int]]]:
+        """Member boundaries of .gz written by `compression.compress`."""
+        members = list()
+        p = 0
+        while p < len(data):
+            if data[p:p+4] != b"\x1f\x8b\x08\x04" or data[p+12:p+14] != compression._GZIP_SUBFIELD:
+                return None
+            size = struct.unpack("<Q", data[p+16:p+24])[0]
+            members.append((p, p + size))
+            p += size
+        return members
+
+    @staticmethod
+    def decompress(
+        data: bytes,
+        workers: int = 1,
+    ) -> bytes:
+        """Decompress (multi-stream) data. Codec is detected from magic bytes.
+
+        Streams are decompressed in parallel if boundaries are known
+        (xz, gzip written by `compression.compress`).
+        """
+        codec = compression.detect(data)
+        view = memoryview(data)
+        if codec == "none":
+            return data
+        elif codec == "xz":
+            func = lambda x: lzma.decompress(x, format=lzma.FORMAT_XZ)
+            streams = compression._xz_streams(data)
+        elif codec == "gzip":
+            func = lambda x: zlib.decompress(x, 16 + zlib.MAX_WBITS)
+            streams = compression._gzip_members(data)
+        else:
+            func = bz2.decompress
+            streams = None
+        if streams is None or workers <= 1:
+            if codec == "gzip":
+                import gzip
+                return gzip.decompress(data)
+            return func(view)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return b"".join(executor.map(func, [view[s:e] for s, e in streams]))
+
+
 class random(object):
     def __init__(self) -> None:
         pass
 
     @staticmethod
-    def image(n=100, shape=[4,4]) -> np.ndarray:
+    def image(n=100, shape=[4,4]) -> "np.ndarray":
         """Generate random (2d) images.
 
         Args:
@@ -208,6 +383,7 @@ class random(object):
         Returns:
             numpy.ndarray
         """
+        import numpy as np
         return np.random.random([n] + list(shape))
 
     @staticmethod
@@ -17,8 +17,17 @@ class __OptionMessages(object):
     configsection: str = "Configuration section name"
     deploy: str = "Deploy data to working directory"
     register: str = "Register annotation results to datafile"
+    watch: str = "Register files continuously as they are moved into label directories (Ctrl+C to stop)"
+    serve: str = "Serve annotation page and JSON API on serve_host:serve_port (Ctrl+C to stop)"
     deployresult: str = "Deploy results (all annotated images)"
     clearworkdir: str = "Clear working directory"
+    workers: str = "Number of deploy processes (0=number of CPUs)"
+    profile: str = "Print per-phase profile and write Chrome trace-event JSON to TRACE_FILE"
+    convertimgstore: str = "Move image column to memory-mapped image store (datafile.imgs.npy/npz)"
+    restore: str = "Restore labels of N-th latest backup generation (1=before the last save)"
+    compact: str = "Fold label journal into datafile"
+    incremental: str = "With --export, append only rows whose labels changed since the last export"
+    prunecache: str = "Evict old files from render cache (down to cache_size)"
 
 option_messages = __OptionMessages()
 
@@ -36,12 +45,35 @@ class __ConfigMessages(object):
     labels: str = "List of initial labels (comma-separated. If null, no initial labels set.)"
     label_null: str = "String representing to be unannotated (If null, '' represens to be unannotated.)"
     random: str = "Deploy randomly (1=Select randomly, 0=order by index)"
+    similar: str = "Similarity order (1=Deploy a batch of similar images in similarity order)"
+    uncertain: str = "Uncertainty sampling (1=Deploy the unlabeled images whose predicted label is the least confident)"
+    presort: str = "Confidence threshold of presort (Deploy puts images predicted with confidence >= presort into the label directory. If null, disabled.)"
+    dedup: str = "Duplicate groups (0=disabled, 1=identical images, 2=also suggest labels of near-identical, rotated or flipped images). Deploy one image of each identical group and Register labels all of them."
     imgext: str = "Image file extension (including .)"
     cmap: str = "matplotlib.cmap (you can use custom cmap name in cmap.py. If null, use default cmap of seaboarn.heatmap.)"
     vmin: str = "seaborn.heatmap.vmin (If null, determined automatically.)"
     vmax: str = "seaborn.heatmap.vmax (If null, determined automatically.)"
     figsize: str = "matplotlib.pyplot.figure.figsize"
-    backup: str = "Backup (1=Copy datafile to datafile~ before save)"
+    renderer: str = "Rendering engine (seaborn=seaborn.heatmap, lut=fast colormap lookup table)"
+    montage: str = "Example montage (1=Deploy examples of each label as one tiled image)"
+    shard: str = "Shard files in label directories into hash-prefix subdirectories (number of hex digits, 0=flat)"
+    prefetch: str = "Prefetch (1=Deploy renders the next batch in background and Register moves it into workdir)"
+    discrete: str = "Discrete values written as 8-bit paletted PNG (renderer=lut) ('auto'=integer images with <= 256 levels, or comma-separated values. If null, disabled.)"
+    workers: str = option_messages.workers
+    worker_maxtasks: str = "Number of tasks before each deploy worker is replaced (If null, never replaced.)"
+    cachedir: str = "Render cache directory (If null, cache is disabled.)"
+    cache_size: str = "Render cache size limit [MB] (If null, unlimited.)"
+    loadcache: str = "Load cache directory for uncompressed copy of datafile (If null, cache is disabled.)"
+    compression: str = "Compression of datafile (xz, gzip, bz2, none. If null, inferred from extension.)"
+    compresslevel: str = "Compression preset/level (If null, codec default.)"
+    fastclear: str = "Fast clear (1=Rename workdir to trash and delete it in background. Deletes all files in workdir.)"
+    journal: str = "Label journal (1=Register appends labels to datafile.journal instead of rewriting datafile)"
+    watch_interval: str = "Poll interval of --watch [s]"
+    watch_save_interval: str = "Save interval of --watch and --serve [s] (labels are also saved on exit)"
+    serve_host: str = "Bind address of --serve"
+    serve_port: str = "Port of --serve"
+    serve_cache_size: str = "Image cache size of --serve [MB] (If null, unlimited.)"
+    backup: str = "Backup (Number of label backup generations in datafile.backup. 0=No backup)"
     verbose: str = "Verbose (1=Print verbose messages)"
 
 config_messages = __ConfigMessages()
@@ -0,0 +1,64 @@
+"""Nearest-centroid label model on image features (see features.py)
+
+Each label is represented by the mean feature vector of its labelled rows.
+The probability of each label is a softmax of the negative squared distances
+to the centroids, scaled by the mean squared distance of the training rows
+to their own centroid; the confidence of a prediction is its probability.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+
+class NearestCentroid(object):
+    def __init__(self, labels: List[str], centroids: np.ndarray, scale: float) -> None:
+        self.labels = np.array(labels, dtype=object)
+        self.centroids = centroids
+        self.scale = scale
+        return None
+
+    @classmethod
+    def fit(cls, feats: np.ndarray, labels: np.ndarray) -> "NearestCentroid":
+        """
+        Args:
+            feats (numpy.ndarray): (n, n_features) features of labelled rows
+            labels (numpy.ndarray): (n,) labels
+        """
+        feats = np.asarray(feats, dtype=np.float32)
+        uniques, codes = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+        counts = np.bincount(codes, minlength=len(uniques)).astype(np.float32)
+        centroids = np.zeros((len(uniques), feats.shape[1]), dtype=np.float32)
+        np.add.at(centroids, codes, feats)
+        centroids /= counts[:, None]
+        spread = float(((feats - centroids[codes]) ** 2).sum(axis=1).mean()) if len(feats) > 0 else 0.0
+        return cls(list(uniques), centroids, max(spread, 1e-6))
+
+    def predict(
+        self,
+        feats: np.ndarray,
+        positions: np.ndarray,
+        chunksize: int = 65536,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Most likely label of rows and its probability.
+
+        Args:
+            feats (numpy.ndarray): Feature matrix of all rows (may be memory-mapped)
+            positions (numpy.ndarray): Rows to predict
+
+        Returns:
+            tuple: (labels, confidence)
+        """
+        codes = np.empty(len(positions), dtype=np.int64)
+        confidence = np.empty(len(positions), dtype=np.float32)
+        c = self.centroids
+        c_sq = (c ** 2).sum(axis=1)
+        for i in range(0, len(positions), chunksize):
+            x = np.asarray(feats[positions[i:i+chunksize]], dtype=np.float32)
+            dist = (x ** 2).sum(axis=1)[:, None] + c_sq[None, :] - 2 * (x @ c.T)
+            logits = -np.maximum(dist, 0) / self.scale
+            logits -= logits.max(axis=1, keepdims=True)
+            p = np.exp(logits)
+            p /= p.sum(axis=1, keepdims=True)
+            codes[i:i+chunksize] = p.argmax(axis=1)
+            confidence[i:i+chunksize] = p.max(axis=1)
+        return (self.labels[codes], confidence)
@@ -0,0 +1,166 @@
+"""Per-phase profiler (timers, counters, tracemalloc peak memory)
+
+Usage:
+    from .profiler import profiler
+
+    with profiler.phase("load"):
+        ...
+    profiler.count("images", n)
+
+    @profiler.profile("deploy")
+    def deploy(...):
+        ...
+
+Hooks cost one attribute check when the profiler is disabled.
+"""
+import os
+import json
+import functools
+import time
+import threading
+import tracemalloc
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Union, Optional
+
+
+_NULL = nullcontext()
+
+
+class _Phase(object):
+    __slots__ = ("profiler", "name", "start", "peak")
+
+    def __init__(self, profiler: "Profiler", name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.peak = 0
+        return None
+
+    def __enter__(self) -> "_Phase":
+        self.profiler._enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        end = time.perf_counter()
+        self.profiler._exit(self, end)
+        return None
+
+
+class Profiler(object):
+    def __init__(self) -> None:
+        self.enabled = False
+        self.trace_memory = False
+        self._reset()
+        return None
+
+    def _reset(self) -> None:
+        self.events = list()
+        self.stats = dict()
+        self.counters = dict()
+        self._stack = list()
+        self._t0 = time.perf_counter()
+        return None
+
+    def enable(self, trace_memory: bool = True) -> None:
+        self._reset()
+        self.enabled = True
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return None
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return None
+
+    def phase(self, name: str):
+        """Context manager timing a phase (no-op if disabled)."""
+        if not self.enabled:
+            return _NULL
+        return _Phase(self, name)
+
+    def profile(self, name: str):
+        """Decorator timing each call of a function as a phase."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Phase(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+        return None
+
+    def _enter(self, phase: _Phase) -> None:
+        if self.trace_memory:
+            # peak so far belongs to the enclosing phase
+            peak = tracemalloc.get_traced_memory()[1]
+            if len(self._stack) > 0:
+                self._stack[-1].peak = max(self._stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+        self._stack.append(phase)
+        return None
+
+    def _exit(self, phase: _Phase, end: float) -> None:
+        if self.trace_memory:
+            phase.peak = max(phase.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if len(self._stack) > 0 and self._stack[-1] is phase:
+            self._stack.pop()
+        if len(self._stack) > 0:
+            self._stack[-1].peak = max(self._stack[-1].peak, phase.peak)
+
+        dur = end - phase.start
+        s = self.stats.setdefault(
+            phase.name, dict(calls=0, total=0.0, max=0.0, peak=0))
+        s["calls"] += 1
+        s["total"] += dur
+        s["max"] = max(s["max"], dur)
+        s["peak"] = max(s["peak"], phase.peak)
+        self.events.append(dict(
+            name=phase.name,
+            cat="annotation",
+            ph="X",
+            ts=(phase.start - self._t0) * 1e6,
+            dur=dur * 1e6,
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+            args=dict(peak_mb=phase.peak / 1024 / 1024) if self.trace_memory else dict(),
+        ))
+        return None
+
+    def summary(self) -> str:
+        lines = ["{:<24} {:>7} {:>11} {:>11} {:>10}".format(
+            "phase", "calls", "total[s]", "max[s]", "peak[MB]")]
+        for name, s in sorted(self.stats.items(), key=lambda x: -x[1]["total"]):
+            lines.append("{:<24} {:>7} {:>11.4f} {:>11.4f} {:>10}".format(
+                name, s["calls"], s["total"], s["max"],
+                f"{s['peak'] / 1024 / 1024:.1f}" if self.trace_memory else "-"))
+        if len(self.counters) > 0:
+            lines.append("")
+            lines.append("{:<24} {:>7}".format("counter", "value"))
+            for name, value in sorted(self.counters.items()):
+                lines.append("{:<24} {:>7}".format(name, value))
+        return "\n".join(lines)
+
+    def write_trace(self, filepath: Union[Path, str]) -> None:
+        """Write Chrome trace-event JSON (chrome://tracing, Perfetto)."""
+        ts = (time.perf_counter() - self._t0) * 1e6
+        events = list(self.events)
+        for name, value in self.counters.items():
+            events.append(dict(
+                name=name, ph="C", ts=ts, pid=os.getpid(), args={name: value}))
+        with open(filepath, mode="w") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+        return None
+
+
+profiler = Profiler()
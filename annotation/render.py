@@ -0,0 +1,542 @@
+"""Image rendering engines
+
+- seaborn: `seaborn.heatmap` on a matplotlib figure (one figure per image)
+- lut: colormap lookup table with NumPy, nearest-neighbour upscaling
+  and direct PNG encoding (no figure)
+"""
+import io
+import os
+import struct
+import zlib
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Optional, Union, List, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from .profiler import profiler
+import matplotlib
+matplotlib.use("Agg")
+# matplotlib.pyplot is imported in the seaborn engine only (slow import)
+from matplotlib.colors import LinearSegmentedColormap
+
+
+# matplotlib default dpi (figsize[inch] * DPI = image size[pixel])
+DPI = 100
+ENGINES = ("seaborn", "lut")
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# background of montage gaps/padding (RGBA)
+_MONTAGE_BACKGROUND = (255, 255, 255, 255)
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + tag
+        + data
+        + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    )
+
+
+def encode_png(
+    arr: np.ndarray,
+    compresslevel: int = 6,
+    palette: Optional[np.ndarray] = None,
+) -> bytes:
+    """Encode uint8 image array to PNG bytes.
+
+    Args:
+        arr (numpy.ndarray): uint8 array, shape (H, W, 3) or (H, W, 4),
+            or (H, W) palette indices if `palette` is given
+        compresslevel (int, optional): zlib compression level
+        palette (numpy.ndarray, optional): (N, 4) uint8 RGBA palette (N <= 256)
+
+    Returns:
+        bytes
+    """
+    arr = np.ascontiguousarray(arr, dtype=np.uint8)
+    chunks = list()
+    if palette is not None:
+        palette = np.asarray(palette, dtype=np.uint8)
+        if arr.ndim != 2 or len(palette) > 256:
+            raise ValueError("arr.shape must be (H, W) and len(palette) <= 256")
+        arr = arr[:, :, None]
+        colortype = 3
+        chunks.append(_png_chunk(b"PLTE", palette[:, :3].tobytes()))
+        if (palette[:, 3] < 255).any():
+            chunks.append(_png_chunk(b"tRNS", palette[:, 3].tobytes()))
+    elif arr.ndim != 3 or arr.shape[2] not in (3, 4):
+        raise ValueError("arr.shape must be (H, W, 3) or (H, W, 4)")
+    else:
+        colortype = 6 if arr.shape[2] == 4 else 2
+    h, w, c = arr.shape
+
+    # filter: None(0) for the first row, Up(2) for the others
+    rows = arr.reshape(h, w * c)
+    filtered = np.empty((h, w * c + 1), dtype=np.uint8)
+    filtered[0, 0] = 0
+    filtered[1:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    filtered[1:, 1:] = rows[1:] - rows[:-1]
+
+    header = struct.pack(">IIBBBBB", w, h, 8, colortype, 0, 0, 0)
+    return b"".join([
+        _PNG_SIGNATURE,
+        _png_chunk(b"IHDR", header),
+        *chunks,
+        _png_chunk(b"IDAT", zlib.compress(filtered.tobytes(), compresslevel)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+
+def get_cmap(
+    name: Optional[str] = None,
+    cmaps: Optional[dict] = None,
+):
+    """Get matplotlib colormap.
+
+    Args:
+        name (str, optional): Colormap name (If None, seaborn.heatmap-default cmap)
+        cmaps (dict, optional): Custom colormaps (see cmap.py)
+
+    Returns:
+        matplotlib.colors.Colormap
+    """
+    if cmaps is None:
+        cmaps = dict()
+    if name in cmaps:
+        return LinearSegmentedColormap.from_list(**cmaps[name])
+    if name is None:
+        import seaborn as sns
+        return sns.cm.rocket
+    return matplotlib.colormaps[name]
+
+
+class Renderer(object):
+    def __init__(
+        self,
+        engine: str = "seaborn",
+        cmap: Optional[str] = None,
+        cmaps: Optional[dict] = None,
+        vmin: Optional[float] = None,
+        vmax: Optional[float] = None,
+        figsize: Union[List[float], Tuple[float, float]] = (4, 4),
+        discrete: Optional[Union[str, List[float]]] = None,
+    ) -> None:
+        if engine not in ENGINES:
+            raise ValueError(f"renderer must be in {list(ENGINES)}")
+        self.engine = engine
+        self.cmap = cmap
+        self.cmaps = dict() if cmaps is None else cmaps
+        self.vmin = vmin
+        self.vmax = vmax
+        self.figsize = tuple(figsize)
+        if discrete is not None and discrete != "auto":
+            discrete = np.unique(np.asarray(discrete, dtype=np.float64))
+            if len(discrete) > 256:
+                raise ValueError("discrete must have at most 256 values")
+        self.discrete = discrete
+        self._lut: Optional[np.ndarray] = None
+        return None
+
+    @property
+    def settings(self) -> str:
+        """String identifying the rendered look (used as a cache key)."""
+        return repr((
+            self.engine,
+            self.cmap,
+            self.cmaps.get(self.cmap),
+            self.vmin,
+            self.vmax,
+            self.figsize,
+            None if self.discrete is None else str(self.discrete),
+        ))
+
+    def __getstate__(self) -> dict:
+        # LUT is rebuilt in each process
+        state = self.__dict__.copy()
+        state["_lut"] = None
+        return state
+
+    @property
+    def lut(self) -> np.ndarray:
+        """(N+1, 4) uint8 RGBA table. The last entry is the color for NaN."""
+        if self._lut is None:
+            cmap = get_cmap(self.cmap, self.cmaps)
+            lut = np.empty((cmap.N + 1, 4), dtype=np.uint8)
+            lut[:-1] = cmap(np.arange(cmap.N), bytes=True)
+            lut[-1] = cmap(np.nan, bytes=True)
+            self._lut = lut
+        return self._lut
+
+    def _limits(self, m: np.ndarray, finite: np.ndarray) -> Tuple[float, float]:
+        vmin, vmax = self.vmin, self.vmax
+        if (vmin is None or vmax is None) and finite.any():
+            if vmin is None:
+                vmin = m[finite].min()
+            if vmax is None:
+                vmax = m[finite].max()
+        vmin = 0.0 if vmin is None else vmin
+        vmax = 0.0 if vmax is None else vmax
+        return (vmin, vmax)
+
+    def normalize(
+        self,
+        m: np.ndarray,
+        limits: Optional[Tuple[float, float]] = None,
+    ) -> np.ndarray:
+        """Convert image to LUT indices (like matplotlib.colors.Normalize)."""
+        m = np.asarray(m, dtype=np.float64)
+        n = len(self.lut) - 1
+        finite = np.isfinite(m)
+        vmin, vmax = self._limits(m, finite) if limits is None else limits
+
+        if vmax > vmin:
+            x = (m - vmin) * (n / (vmax - vmin))
+        else:
+            x = np.zeros_like(m)
+        idx = np.clip(np.where(finite, x, 0), 0, n - 1).astype(np.intp)
+        idx[~finite] = n
+        return idx
+
+    def to_indexed(self, m: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Render discrete-valued image to palette indices (lut engine).
+
+        Values are taken from `discrete` ("auto": integer images with
+        at most 256 distinct levels between min and max).
+        Colors are the same as `to_array`.
+
+        Returns:
+            tuple: ((H, W) uint8 indices, (N, 4) uint8 RGBA palette),
+                or None if the image is not discrete
+        """
+        if self.discrete is None or self.engine != "lut":
+            return None
+        m = np.asarray(m)
+        if m.size == 0:
+            return None
+        if isinstance(self.discrete, str):
+            if m.dtype.kind not in "iub":
+                return None
+            lo, hi = int(m.min()), int(m.max())
+            if hi - lo >= 256:
+                return None
+            values = np.arange(lo, hi + 1, dtype=np.float64)
+            idx = (m - lo).astype(np.uint8)
+            limits = self._limits(values, np.ones(len(values), dtype=bool))
+        else:
+            values = self.discrete
+            pos = np.minimum(np.searchsorted(values, m), len(values) - 1)
+            if not (values[pos] == m).all():
+                return None
+            idx = pos.astype(np.uint8)
+            limits = self._limits(m, np.isfinite(m))
+        palette = self.lut[self.normalize(values, limits=limits)]
+        return (self._upscale(idx), palette)
+
+    def _scale(self, h: int, w: int) -> int:
+        width, height = self.figsize[0] * DPI, self.figsize[1] * DPI
+        return max(1, int(min(height // h, width // w)))
+
+    @staticmethod
+    def _repeat(arr: np.ndarray, scale: int) -> np.ndarray:
+        if scale > 1:
+            # nearest-neighbour: one copy via a broadcast view
+            h, w = arr.shape[:2]
+            view = np.broadcast_to(
+                arr[:, None, :, None],
+                (h, scale, w, scale) + arr.shape[2:])
+            arr = view.reshape((h * scale, w * scale) + arr.shape[2:])
+        return arr
+
+    def _upscale(self, arr: np.ndarray) -> np.ndarray:
+        return self._repeat(arr, self._scale(*arr.shape[:2]))
+
+    def to_array(self, m: np.ndarray) -> np.ndarray:
+        """Render 2d image to (H, W, 4) uint8 RGBA array."""
+        if self.engine == "lut":
+            return self._upscale(self.lut[self.normalize(m)])
+
+        import matplotlib.pyplot as plt
+        fig = self._draw_seaborn(m)
+        fig.canvas.draw()
+        arr = np.asarray(fig.canvas.buffer_rgba()).copy()
+        fig.clf()
+        plt.close(fig)
+        return arr
+
+    def montage(
+        self,
+        imgs: List[np.ndarray],
+        ncols: Optional[int] = None,
+        gap: int = 1,
+    ) -> np.ndarray:
+        """Render images as one tiled (H, W, 4) uint8 RGBA array.
+
+        Images are tiled before rendering, so the montage is drawn once:
+        with the lut engine, tiled as LUT indices and colored/upscaled once;
+        with seaborn, tiled as values (normalized per image like a single
+        heatmap) and drawn by one heatmap on a figure of
+        `figsize` * (ncols, nrows). Each tile is about `figsize`.
+        """
+        n = len(imgs)
+        if ncols is None:
+            ncols = int(np.ceil(np.sqrt(n)))
+        nrows = -(-n // ncols)
+
+        if self.engine == "lut":
+            background = len(self.lut)
+            lut = np.vstack([self.lut, _MONTAGE_BACKGROUND]).astype(np.uint8)
+            tiles = [self.normalize(m) for m in imgs]
+        else:
+            background = np.nan
+            tiles = list()
+            for m in imgs:
+                m = np.asarray(m, dtype=np.float64)
+                vmin, vmax = self._limits(m, np.isfinite(m))
+                tiles.append((m - vmin) / (vmax - vmin) if vmax > vmin else np.zeros_like(m))
+        h = max(t.shape[0] for t in tiles) + gap
+        w = max(t.shape[1] for t in tiles) + gap
+        channels = tiles[0].shape[2:]
+
+        grid = np.full(
+            (nrows * ncols, h, w) + channels, background,
+            dtype=tiles[0].dtype)
+        for i, t in enumerate(tiles):
+            grid[i, :t.shape[0], :t.shape[1]] = t
+        grid = grid.reshape((nrows, ncols, h, w) + channels).swapaxes(1, 2)
+        grid = grid.reshape((nrows * h, ncols * w) + channels)
+
+        if self.engine == "lut":
+            return lut[self._repeat(grid, self._scale(h, w))]
+        import matplotlib.pyplot as plt
+        fig = self._draw_seaborn(
+            grid, figsize=(self.figsize[0] * ncols, self.figsize[1] * nrows),
+            limits=(0.0, 1.0))
+        fig.canvas.draw()
+        arr = np.asarray(fig.canvas.buffer_rgba()).copy()
+        fig.clf()
+        plt.close(fig)
+        return arr
+
+    def _draw_seaborn(
+        self,
+        m: np.ndarray,
+        figsize: Optional[Tuple[float, float]] = None,
+        limits: Optional[Tuple[float, float]] = None,
+    ):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        if self.cmap in self.cmaps.keys():
+            _cmap = LinearSegmentedColormap.from_list(
+                **self.cmaps[self.cmap]
+            )
+        else:
+            _cmap = self.cmap
+
+        vmin, vmax = (self.vmin, self.vmax) if limits is None else limits
+        fig = plt.figure(figsize=self.figsize if figsize is None else figsize)
+        ax = fig.add_subplot(111)
+        sns.heatmap(
+            m, vmin=vmin, vmax=vmax, cmap=_cmap,
+            cbar=False, xticklabels=[], yticklabels=[], ax=ax)
+        return fig
+
+    def to_png(self, m: np.ndarray) -> bytes:
+        """Render 2d image to PNG bytes (in memory)."""
+        if self.engine == "seaborn":
+            import matplotlib.pyplot as plt
+            fig = self._draw_seaborn(m)
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png")
+            fig.clf()
+            plt.close(fig)
+            return buf.getvalue()
+
+        indexed = self.to_indexed(m)
+        if indexed is not None:
+            return encode_png(indexed[0], palette=indexed[1])
+        return encode_png(self.to_array(m))
+
+    def save(self, m: np.ndarray, filepath: Union[Path, str]) -> None:
+        if self.engine == "seaborn":
+            import matplotlib.pyplot as plt
+            with profiler.phase("render.figure"):
+                fig = self._draw_seaborn(m)
+            with profiler.phase("render.savefig"):
+                fig.savefig(filepath)
+            fig.clf()
+            plt.close()
+            return None
+
+        with profiler.phase("render.lut"):
+            indexed = self.to_indexed(m)
+            if indexed is None:
+                arr = self.to_array(m)
+        if indexed is not None:
+            profiler.count("images.indexed")
+            write_image(indexed[0], filepath, palette=indexed[1])
+            return None
+        write_image(arr, filepath)
+        return None
+
+
+def write_image(
+    arr: np.ndarray,
+    filepath: Union[Path, str],
+    palette: Optional[np.ndarray] = None,
+) -> None:
+    """Write RGBA uint8 array (or palette indices) to an image file.
+
+    PNG is encoded directly (8-bit paletted if `palette` is given).
+    """
+    filepath = Path(filepath)
+    if filepath.suffix.lower() == ".png":
+        with profiler.phase("render.encode"):
+            data = encode_png(arr, palette=palette)
+        with profiler.phase("render.write"):
+            filepath.write_bytes(data)
+    else:
+        from PIL import Image
+        if palette is not None:
+            arr = np.asarray(palette, dtype=np.uint8)[arr]
+        img = Image.fromarray(arr)
+        if filepath.suffix.lower() in (".jpg", ".jpeg", ".bmp"):
+            img = img.convert("RGB")
+        img.save(filepath)
+    return None
+
+
+class SharedImages(object):
+    """Images packed into one flat `multiprocessing.shared_memory` buffer.
+
+    Workers attach to the buffer by name and get zero-copy views,
+    so the image arrays are never pickled.
+    """
+    def __init__(
+        self,
+        name: str,
+        dtype: str,
+        offsets: np.ndarray,
+        shapes: np.ndarray,
+        create: bool = False,
+        size: int = 0,
+    ) -> None:
+        self.shm = SharedMemory(name=name, create=create, size=size)
+        self.dtype = np.dtype(dtype)
+        self.offsets = offsets
+        self.shapes = shapes
+        self._owner = create
+        return None
+
+    @classmethod
+    def create(cls, imgs: List[np.ndarray]) -> "SharedImages":
+        imgs = [np.asarray(m) for m in imgs]
+        dtype = np.result_type(*{m.dtype for m in imgs})
+        sizes = np.array([m.size for m in imgs], dtype=np.int64)
+        offsets = np.zeros(len(imgs) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        shapes = np.array([m.shape for m in imgs], dtype=np.int64)
+
+        self = cls(
+            name=None,
+            dtype=dtype.str,
+            offsets=offsets,
+            shapes=shapes,
+            create=True,
+            size=max(1, int(offsets[-1]) * dtype.itemsize),
+        )
+        buf = self.buffer
+        for i, m in enumerate(imgs):
+            buf[offsets[i]:offsets[i+1]] = m.ravel()
+        return self
+
+    @property
+    def buffer(self) -> np.ndarray:
+        return np.ndarray(
+            int(self.offsets[-1]), dtype=self.dtype, buffer=self.shm.buf)
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.buffer[self.offsets[i]:self.offsets[i+1]].reshape(self.shapes[i])
+
+    def attach_args(self) -> tuple:
+        return (self.shm.name, self.dtype.str, self.offsets, self.shapes)
+
+    def close(self) -> None:
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+        return None
+
+
+# per-process state of deploy workers
+_worker: dict = dict()
+
+
+def _init_worker(renderer: Renderer, *shared_args) -> None:
+    _worker["renderer"] = renderer
+    _worker["imgs"] = SharedImages(*shared_args)
+    return None
+
+
+def _render_chunk(chunk: List[Tuple[int, str]]) -> int:
+    renderer = _worker["renderer"]
+    imgs = _worker["imgs"]
+    for i, filepath in chunk:
+        renderer.save(m=imgs[i], filepath=filepath)
+    return len(chunk)
+
+
+@profiler.profile("save_images")
+def save_images(
+    renderer: Renderer,
+    imgs: List[np.ndarray],
+    filepaths: List[str],
+    workers: Optional[int] = 1,
+    maxtasksperchild: Optional[int] = None,
+    chunksize: int = 16,
+) -> None:
+    """Render and save images (in parallel if `workers` > 1).
+
+    Args:
+        renderer (Renderer): Renderer
+        imgs (list): 2d images
+        filepaths (list): Output file paths
+        workers (int, optional): Number of processes (If 0 or None, os.cpu_count())
+        maxtasksperchild (int, optional): Recycle each worker after this number of chunks
+        chunksize (int, optional): Number of images per task
+    """
+    if len(imgs) != len(filepaths):
+        raise ValueError("len(imgs) != len(filepaths)")
+    profiler.count("images", len(imgs))
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, -(-len(imgs) // chunksize))
+
+    if workers <= 1:
+        for m, filepath in tqdm(zip(imgs, filepaths), total=len(imgs)):
+            renderer.save(m=m, filepath=filepath)
+        return None
+
+    shared = SharedImages.create(imgs)
+    try:
+        tasks = list(enumerate(map(str, filepaths)))
+        chunks = [tasks[i:i+chunksize] for i in range(0, len(tasks), chunksize)]
+        with Pool(
+            processes=workers,
+            initializer=_init_worker,
+            initargs=(renderer, *shared.attach_args()),
+            maxtasksperchild=maxtasksperchild,
+        ) as pool, tqdm(total=len(tasks)) as pbar:
+            for n in pool.imap_unordered(_render_chunk, chunks):
+                pbar.update(n)
+    finally:
+        shared.close()
+    return None
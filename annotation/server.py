@@ -0,0 +1,378 @@
+"""Local HTTP annotation server
+
+The loaded `Data` is shared by all clients (browsers).
+Images are rendered on demand into an in-memory LRU cache and labels are
+assigned through a JSON API, then saved in batches.
+
+- `GET /`: annotation page
+- `GET /api/info`: `{"n": int, "annotated": int, "labels": [str]}`
+- `GET /api/batch?n=N`: `{"ids": [str]}` unlabeled ids (leased to the client
+  for `lease` seconds, so other clients get other ids)
+- `GET /api/examples?label=LABEL&n=N`: `{"ids": [str]}`
+- `GET /img/<id>.png`: rendered image
+- `POST /api/labels` `{"labels": {"<id>": "<label>"}}`:
+  `{"n_success": int, "n_failure": int}` (400 if a label is empty, `label_null`,
+  contains `/`, `\\` or `..`, or starts with `.`)
+- `POST /api/save`: save pending labels now
+"""
+import json
+import time
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, List, Tuple
+from urllib.parse import urlparse, parse_qs, unquote
+from warnings import catch_warnings
+
+from .profiler import profiler
+
+
+def check_label(label: str, label_null: str) -> None:
+    """Raise ValueError unless `label` can be a label directory name."""
+    if (label == "" or label == label_null or label.startswith(".")
+            or "/" in label or "\\" in label or ".." in label):
+        raise ValueError(f"invalid label '{label}'")
+    return None
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache of bytes (limited by total size)."""
+    def __init__(self, size: Optional[float] = None) -> None:
+        """
+        Args:
+            size (float, optional): Size limit [MB] (If None, unlimited)
+        """
+        self.limit = None if size is None else int(size * 1024 * 1024)
+        self.nbytes = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._items[key] = value
+            self.nbytes += len(value)
+            while self.limit is not None and self.nbytes > self.limit and len(self._items) > 1:
+                _, old = self._items.popitem(last=False)
+                self.nbytes -= len(old)
+        return None
+
+
+class AnnotationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        data,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        cache_size: Optional[float] = None,
+        save_interval: float = 60.0,
+        lease: float = 600.0,
+    ) -> None:
+        """
+        Args:
+            data (Data): Loaded data
+            host (str, optional): Bind address
+            port (int, optional): Port (0=any free port)
+            cache_size (float, optional): Image cache size [MB]
+            save_interval (float, optional): Save interval of labels [s]
+            lease (float, optional): Seconds until ids of a batch can be
+                handed out again
+        """
+        super().__init__((host, port), _Handler)
+        self.data = data
+        self.renderer = data.get_renderer()
+        self.cache = LRUCache(cache_size)
+        self.save_interval = save_interval
+        self.lease = lease
+        # guards data (labels, selection)
+        self.lock = threading.RLock()
+        # matplotlib (seaborn engine) is not thread-safe
+        self._render_lock = threading.Lock()
+        self._leases = dict()
+        self._pending = dict()
+        self._stop = threading.Event()
+        self._saver = threading.Thread(target=self._save_loop, name="serve.save", daemon=True)
+        return None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _ids(self, df) -> List[str]:
+        if self.data._index_as_filename:
+            return [str(x) for x in df.index]
+        return [str(x) for x in df[self.data.col_filename]]
+
+    def info(self) -> dict:
+        with self.lock:
+            return dict(
+                n=self.data.count("all"),
+                annotated=int(self.data.count("annotated")),
+                labels=list(self.data.labels),
+            )
+
+    def batch(self, n: int) -> List[str]:
+        with self.lock:
+            now = time.monotonic()
+            self._leases = {k: v for k, v in self._leases.items() if v > now}
+            exclude = self.data._get_positions(list(self._leases.keys()))
+            df = self.data.get_labelled(
+                label=None, sample=self.data.random, head=not self.data.random,
+                n=n, exclude=self.data._exclude_duplicates(exclude[exclude >= 0]))
+            ids = self._ids(df)
+            for name in ids:
+                self._leases[name] = now + self.lease
+        return ids
+
+    def examples(self, label: str, n: int) -> List[str]:
+        with self.lock:
+            return self._ids(self.data.get_labelled(label=label, sample=True, n=n))
+
+    def image(self, name: str) -> Optional[bytes]:
+        png = self.cache.get(name)
+        if png is not None:
+            profiler.count("serve.cache.hit")
+            return png
+        with self.lock:
+            positions = self.data._get_positions([name])
+            if positions[0] < 0:
+                return None
+            m = self.data.get_imgs(positions)[0]
+        profiler.count("serve.cache.miss")
+        if self.renderer.engine == "seaborn":
+            with self._render_lock:
+                png = self.renderer.to_png(m)
+        else:
+            png = self.renderer.to_png(m)
+        self.cache.put(name, png)
+        return png
+
+    def set_labels(self, labels: dict) -> Tuple[int, int]:
+        """Raises ValueError for an invalid label (no label is set)."""
+        names = [str(k) for k in labels.keys()]
+        values = [str(v) for v in labels.values()]
+        for label in set(values):
+            check_label(label, self.data.label_null)
+        with self.lock:
+            for label in set(values):
+                self.data._add_label(label)
+            with catch_warnings(record=True):
+                n_success, n_failure, changed, changed_labels = self.data._register_names(
+                    names, values)
+            for name, label in zip(changed, changed_labels):
+                self._pending[name] = label
+            for name in names:
+                self._leases.pop(name, None)
+        return (n_success, n_failure)
+
+    def flush(self) -> int:
+        """Save pending labels (journal if `journal`)."""
+        with self.lock:
+            n = len(self._pending)
+            if n == 0:
+                return 0
+            with profiler.phase("serve.save"):
+                if self.data.journal:
+                    self.data._append_journal(
+                        list(self._pending.keys()), list(self._pending.values()))
+                else:
+                    self.data.save(clear_workdir=False)
+            self._pending.clear()
+        if self.data.verbose:
+            print(f"serve: saved {n} labels")
+        return n
+
+    def _save_loop(self) -> None:
+        while not self._stop.wait(self.save_interval):
+            self.flush()
+        return None
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self._saver.start()
+        try:
+            super().serve_forever(poll_interval=poll_interval)
+        finally:
+            self._stop.set()
+            self.flush()
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: AnnotationServer
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.data.verbose:
+            super().log_message(format, *args)
+        return None
+
+    def _send(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+    def _send_json(self, obj, status: int = 200) -> None:
+        self._send(json.dumps(obj, ensure_ascii=False).encode("utf-8"),
+                   "application/json; charset=utf-8", status=status)
+        return None
+
+    def _error(self, status: int, message: str) -> None:
+        self._send_json(dict(error=message), status=status)
+        return None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server = self.server
+        try:
+            n = int(query.get("n", ["0"])[0]) or server.data.n or 30
+        except ValueError:
+            return self._error(400, "n must be int")
+
+        if url.path == "/":
+            return self._send(_PAGE.encode("utf-8"), "text/html; charset=utf-8")
+        if url.path == "/api/info":
+            return self._send_json(server.info())
+        if url.path == "/api/batch":
+            return self._send_json(dict(ids=server.batch(n)))
+        if url.path == "/api/examples":
+            label = query.get("label", [None])[0]
+            if label is None:
+                return self._error(400, "label is required")
+            return self._send_json(dict(ids=server.examples(label, n)))
+        if url.path.startswith("/img/") and url.path.endswith(".png"):
+            name = unquote(url.path[len("/img/"):-len(".png")])
+            png = server.image(name)
+            if png is None:
+                return self._error(404, f"id '{name}' is not found")
+            return self._send(png, "image/png")
+        return self._error(404, "not found")
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        server = self.server
+        if url.path == "/api/save":
+            return self._send_json(dict(saved=server.flush()))
+        if url.path != "/api/labels":
+            return self._error(404, "not found")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            labels = body["labels"]
+            if not isinstance(labels, dict):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return self._error(400, 'body must be {"labels": {"<id>": "<label>"}}')
+        try:
+            n_success, n_failure = server.set_labels(labels)
+        except ValueError as e:
+            return self._error(400, str(e))
+        return self._send_json(dict(n_success=n_success, n_failure=n_failure))
+
+
+def serve(
+    data,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    cache_size: Optional[float] = None,
+    save_interval: float = 60.0,
+) -> None:
+    """Serve until Ctrl+C (pending labels are saved on exit)."""
+    server = AnnotationServer(
+        data, host=host, port=port,
+        cache_size=cache_size, save_interval=save_interval)
+    print(f"serve: {server.url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return None
+
+
+_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>annotation</title>
+<style>
+body { font-family: sans-serif; margin: 1em; }
+#labels button { margin: 0 .3em .3em 0; }
+#imgs img { width: 160px; margin: 2px; border: 3px solid transparent; cursor: pointer; }
+#imgs img.selected { border-color: #e33; }
+</style>
+</head>
+<body>
+<div id="info"></div>
+<div id="labels"></div>
+<p>
+  <input id="newlabel" placeholder="new label">
+  <button onclick="addLabel()">add</button>
+  <button onclick="loadBatch()">next batch</button>
+  <button onclick="fetch('/api/save', {method: 'POST'})">save</button>
+</p>
+<div id="imgs"></div>
+<script>
+let labels = [];
+async function loadInfo() {
+  const info = await (await fetch("/api/info")).json();
+  labels = info.labels;
+  document.getElementById("info").textContent =
+    `annotated: ${info.annotated} / ${info.n}`;
+  const div = document.getElementById("labels");
+  div.innerHTML = "";
+  for (const label of labels) {
+    const b = document.createElement("button");
+    b.textContent = label;
+    b.onclick = () => assign(label);
+    div.appendChild(b);
+  }
+}
+async function loadBatch() {
+  const batch = await (await fetch("/api/batch")).json();
+  const div = document.getElementById("imgs");
+  div.innerHTML = "";
+  for (const id of batch.ids) {
+    const img = document.createElement("img");
+    img.src = "/img/" + encodeURIComponent(id) + ".png";
+    img.title = id;
+    img.dataset.id = id;
+    img.onclick = () => img.classList.toggle("selected");
+    div.appendChild(img);
+  }
+}
+async function assign(label) {
+  const selected = document.querySelectorAll("#imgs img.selected");
+  const body = {labels: {}};
+  selected.forEach(img => { body.labels[img.dataset.id] = label; });
+  await fetch("/api/labels", {method: "POST", body: JSON.stringify(body)});
+  selected.forEach(img => img.remove());
+  await loadInfo();
+  if (document.querySelectorAll("#imgs img").length == 0) { await loadBatch(); }
+}
+function addLabel() {
+  const label = document.getElementById("newlabel").value.trim();
+  if (label && !labels.includes(label)) { labels.push(label); assign(label); }
+}
+loadInfo();
+loadBatch();
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,89 @@
+"""Memory-mapped contiguous image store
+
+All images are stored in one flat `.npy` buffer (opened with `numpy.memmap`)
+and an index (`.npz`) of ids, offsets and shapes.
+Images are paged in from disk only when they are accessed.
+
+- `<path>.npy`: flat buffer
+- `<path>.npz`: index (ids, offsets, shapes)
+"""
+from pathlib import Path
+from typing import Union, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+
+class ImageStore(object):
+    def __init__(
+        self,
+        buffer: np.ndarray,
+        ids: np.ndarray,
+        offsets: np.ndarray,
+        shapes: np.ndarray,
+    ) -> None:
+        self.buffer = buffer
+        self.ids = pd.Index(ids.astype(str))
+        self.offsets = offsets
+        self.shapes = shapes
+        return None
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.buffer[self.offsets[i]:self.offsets[i+1]].reshape(self.shapes[i])
+
+    @staticmethod
+    def paths(path: Union[Path, str]) -> tuple:
+        return (Path(str(path) + ".npy"), Path(str(path) + ".npz"))
+
+    @classmethod
+    def exists(cls, path: Union[Path, str]) -> bool:
+        return all(p.is_file() for p in cls.paths(path))
+
+    @classmethod
+    def open(cls, path: Union[Path, str]) -> "ImageStore":
+        bufferpath, indexpath = cls.paths(path)
+        with np.load(indexpath, allow_pickle=False) as index:
+            ids = index["ids"]
+            offsets = index["offsets"]
+            shapes = index["shapes"]
+        buffer = np.load(bufferpath, mmap_mode="r")
+        return cls(buffer=buffer, ids=ids, offsets=offsets, shapes=shapes)
+
+    @classmethod
+    def convert(
+        cls,
+        imgs: List[np.ndarray],
+        ids: Iterable,
+        path: Union[Path, str],
+    ) -> "ImageStore":
+        """Write images to a store.
+
+        Args:
+            imgs (list): 2d images
+            ids (iterable): Image ids (converted to str)
+            path (str or Path): Store path (without suffix)
+
+        Returns:
+            ImageStore
+        """
+        ids = np.array([str(x) for x in ids])
+        if len(ids) != len(imgs):
+            raise ValueError("len(ids) != len(imgs)")
+        dtype = np.result_type(*{np.asarray(m).dtype for m in imgs}) if len(imgs) > 0 else np.float64
+        shapes = np.array([np.shape(m) for m in imgs], dtype=np.int64).reshape(-1, 2)
+        offsets = np.zeros(len(imgs) + 1, dtype=np.int64)
+        np.cumsum(shapes.prod(axis=1), out=offsets[1:])
+
+        bufferpath, indexpath = cls.paths(path)
+        buffer = np.lib.format.open_memmap(
+            bufferpath, mode="w+", dtype=dtype, shape=(int(offsets[-1]),))
+        for i, m in enumerate(imgs):
+            buffer[offsets[i]:offsets[i+1]] = np.asarray(m).ravel()
+        buffer.flush()
+        del buffer
+        with indexpath.open(mode="wb") as f:
+            np.savez(f, ids=ids, offsets=offsets, shapes=shapes)
+        return cls.open(path)
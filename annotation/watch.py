@@ -0,0 +1,94 @@
+"""Polling watcher of label directories in the working directory
+
+Label directories are scanned recursively (shard subdirectories, see
+`shard`). Only label directories in which the mtime of the directory or one
+of its subdirectories changed are rescanned (`os.scandir`), so a poll costs
+one `stat` per (sub)directory when nothing moved.
+"""
+import os
+import time
+from pathlib import Path
+from typing import Union, Dict, Set, Tuple, List
+
+
+class LabelDirWatcher(object):
+    # directories modified within this window [s] are rescanned every poll
+    # (a second change in the same mtime tick does not change the mtime)
+    racy: float = 2.0
+
+    def __init__(
+        self,
+        workdir: Union[Path, str],
+        imgext: str,
+        ignore: Tuple[str, ...] = tuple(),
+    ) -> None:
+        self.workdir = str(workdir)
+        self.imgext = imgext
+        self.ignore = set(ignore)
+        # label -> (mtime_ns of its directory, {subdirectory: mtime_ns}, names)
+        self._dirs: Dict[str, Tuple[int, Dict[str, int], Set[str]]] = dict()
+        return None
+
+    def _scan_dir(self, dirpath: str) -> Tuple[Set[str], Dict[str, int]]:
+        """Files in a directory tree and mtimes of its subdirectories"""
+        n = len(self.imgext)
+        names = set()
+        subdirs = dict()
+        stack = [dirpath]
+        while len(stack) > 0:
+            path = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            subdirs[entry.path] = entry.stat().st_mtime_ns
+                        elif entry.name.endswith(self.imgext) and entry.is_file():
+                            names.add(entry.name[:-n])
+            except FileNotFoundError:
+                pass
+        return (names - self.ignore, subdirs)
+
+    @staticmethod
+    def _changed(subdirs: Dict[str, int], now: int, racy: int) -> bool:
+        for path, mtime_ns in subdirs.items():
+            try:
+                current = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                return True
+            if current != mtime_ns or now - current <= racy:
+                return True
+        return False
+
+    def poll(self) -> Tuple[List[str], List[str]]:
+        """Files which appeared in label directories since the last poll.
+
+        Returns:
+            tuple: (names, labels)
+        """
+        names = list()
+        labels = list()
+        now = time.time_ns()
+        racy = int(self.racy * 1e9)
+        dirs = dict()
+        try:
+            with os.scandir(self.workdir) as entries:
+                for entry in entries:
+                    if entry.is_dir() and not entry.name.startswith("."):
+                        dirs[entry.name] = entry.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+
+        for label in set(self._dirs) - set(dirs):
+            del self._dirs[label]
+        for label, mtime_ns in dirs.items():
+            prev_mtime, prev_subdirs, prev_names = self._dirs.get(label, (None, dict(), set()))
+            if (mtime_ns == prev_mtime and now - mtime_ns > racy
+                    and not self._changed(prev_subdirs, now, racy)):
+                continue
+            current, subdirs = self._scan_dir(os.path.join(self.workdir, label))
+            for name in current - prev_names:
+                names.append(name)
+                labels.append(label)
+            self._dirs[label] = (mtime_ns, subdirs, current)
+        return (names, labels)
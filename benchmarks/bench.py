@@ -0,0 +1,283 @@
+"""Benchmark suite for load / deploy / deploy-result / register / save / export
+
+Synthetic WM-811K-shaped datasets (uint8 wafer maps with values 0/1/2 and
+variable map sizes) are generated offline.
+
+Usage:
+    python -m benchmarks --sizes 1000,100000 --output results.json
+    python -m benchmarks --sizes 1000 --compare results.json
+"""
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, List
+
+import numpy as np
+import pandas as pd
+
+from annotation.data import Data, Config, CONFIG_DEFAULT
+from annotation.info import __version__
+
+
+PHASES = ("save", "load", "deploy", "deploy-result", "register", "export")
+LABELS = [
+    "Center", "Donut", "Edge-Loc", "Edge-Ring",
+    "Loc", "Random", "Scratch", "Near-full", "none",
+]
+# WM-811K-like map sizes (side length)
+MAP_SIZES = (26, 32, 38, 45, 52)
+
+
+def make_wafermaps(n: int, rng: np.random.Generator) -> List[np.ndarray]:
+    """Generate wafer maps (0=outside, 1=normal die, 2=defective die)."""
+    sizes = rng.choice(MAP_SIZES, size=n)
+    maps = [None] * n
+    for size in MAP_SIZES:
+        idxs = np.flatnonzero(sizes == size)
+        if len(idxs) == 0:
+            continue
+        yy, xx = np.mgrid[:size, :size]
+        r = (size - 1) / 2
+        wafer = ((yy - r) ** 2 + (xx - r) ** 2) <= r ** 2
+        density = rng.uniform(0.0, 0.3, size=(len(idxs), 1, 1))
+        defect = rng.random((len(idxs), size, size)) < density
+        stack = wafer.astype(np.uint8) + (defect & wafer)
+        for i, m in zip(idxs, stack):
+            maps[i] = m
+    return maps
+
+
+def make_dataframe(n: int, labelled: float = 0.2, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(index=pd.RangeIndex(n))
+    df["waferMap"] = make_wafermaps(n, rng)
+    labels = np.full(n, "", dtype=object)
+    mask = rng.random(n) < labelled
+    labels[mask] = rng.choice(LABELS, size=mask.sum())
+    df["failureType"] = labels
+    return df
+
+
+class Timer(object):
+    def __init__(self, trace_memory: bool = True) -> None:
+        self.trace_memory = trace_memory
+        self.results = dict()
+        return None
+
+    def run(self, phase: str, func, count: Optional[int] = None, unit: str = "rows"):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        ret = func()
+        elapsed = time.perf_counter() - t0
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        if callable(count):
+            count = count()
+        self.results[phase] = dict(
+            time=elapsed,
+            count=count,
+            throughput=None if not count else count / elapsed,
+            unit=f"{unit}/s",
+            peak_mb=peak,
+        )
+        print("  {:<14} {:>10.3f} s  {:>12} {:<10} {}".format(
+            phase, elapsed,
+            "-" if not count else f"{count / elapsed:.1f}", f"{unit}/s",
+            "" if peak is None else f"peak={peak:.1f}MB"))
+        return ret
+
+
+def bench(
+    n: int,
+    tempdir: Path,
+    config: dict,
+    phases: List[str],
+    n_register: int = 1000,
+    trace_memory: bool = True,
+) -> dict:
+    print(f"n={n}")
+    basedir = tempdir / str(n)
+    basedir.mkdir(parents=True, exist_ok=True)
+
+    c = Config(CONFIG_DEFAULT.copy())
+    c.update(
+        datafile=str(basedir / "data.pkl.xz"),
+        workdir=str(basedir / "work"),
+        col_filename="index",
+        col_img="waferMap",
+        col_label="failureType",
+        labels="",
+        label_null="",
+        cmap="coolwarm",
+        vmin="",
+        vmax="",
+        verbose=0,
+        backup=0,
+    )
+    c.update(config)
+    c.conv()
+
+    df = make_dataframe(n)
+    timer = Timer(trace_memory=trace_memory)
+    data = Data(c)
+
+    if "save" in phases or not Path(c["datafile"]).is_file():
+        timer.run("save", lambda: Data._save_pickle(
+            df, c["datafile"], backup=False,
+            compression=c["compression"], compresslevel=c["compresslevel"],
+            workers=data.n_workers), count=n)
+    del df
+
+    timer.run("load", data.load, count=n)
+
+    if "deploy" in phases:
+        timer.run(
+            "deploy", data.deploy, unit="images",
+            count=lambda: sum(1 for _ in data.workdir.rglob(f"*{data.imgext}")))
+
+    if "register" in phases:
+        # deploy (not timed) a batch of `n_register` rows and move all of it to a label dir
+        n_, n_example = data.n, data.n_example
+        data.n, data.n_example = n_register, 0
+        data.deploy()
+        data.n, data.n_example = n_, n_example
+        labeldir = data.workdir / "bench"
+        labeldir.mkdir(exist_ok=True)
+        for filepath in data.workdir.glob(f"*{data.imgext}"):
+            filepath.rename(labeldir / filepath.name)
+        registered = dict()
+
+        def _register() -> None:
+            registered["n"] = data.register(save=False)[0]
+            return None
+
+        timer.run(
+            "register", _register, unit="files",
+            count=lambda: registered["n"])
+        if "save" in phases:
+            timer.run(
+                "save(register)", lambda: data.save(backup=0, clear_workdir=False),
+                count=n)
+
+    if "deploy-result" in phases:
+        n_, n_example = data.n, data.n_example
+        data.n, data.n_example = 0, None
+        timer.run(
+            "deploy-result", data.deploy, unit="images",
+            count=lambda: sum(1 for _ in data.workdir.rglob(f"*{data.imgext}")))
+        data.n, data.n_example = n_, n_example
+
+    if "export" in phases:
+        timer.run("export", lambda: data.export(basedir / "export.csv"), count=n)
+
+    shutil.rmtree(str(basedir), ignore_errors=True)
+    return timer.results
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2) -> List[str]:
+    """Phases slower than baseline by more than `threshold` (ratio)."""
+    regressions = list()
+    for size, phases in results["results"].items():
+        base_phases = baseline.get("results", dict()).get(size, dict())
+        for phase, r in phases.items():
+            if phase not in base_phases:
+                continue
+            b = base_phases[phase]
+            ratio = r["time"] / max(b["time"], 1e-9)
+            flag = ratio > 1 + threshold
+            print("  n={:<8} {:<14} {:>8.3f}s -> {:>8.3f}s  x{:.2f} {}".format(
+                size, phase, b["time"], r["time"], ratio,
+                "REGRESSION" if flag else ""))
+            if flag:
+                regressions.append(f"{size}:{phase}")
+    return regressions
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "--sizes", default="1000",
+        help="Comma-separated dataset sizes (e.g. 1000,100000,800000)")
+    parser.add_argument(
+        "--phases", default=",".join(PHASES),
+        help=f"Comma-separated phases ({','.join(PHASES)})")
+    parser.add_argument(
+        "--output", "-o", default=None,
+        help="Results JSON file")
+    parser.add_argument(
+        "--compare", default=None,
+        help="Baseline results JSON file")
+    parser.add_argument(
+        "--threshold", default=0.2, type=float,
+        help="Regression threshold (0.2 = 20%% slower)")
+    parser.add_argument(
+        "--config", default=[], action="append", metavar="KEY=VALUE",
+        help="Override config value (e.g. --config renderer=lut --config workers=0)")
+    parser.add_argument(
+        "--n-register", default=1000, type=int,
+        help="Number of files deployed and moved before register")
+    parser.add_argument(
+        "--no-tracemalloc", action="store_true",
+        help="Do not measure peak memory (tracemalloc slows down allocations)")
+    parser.add_argument(
+        "--tempdir", default=None,
+        help="Working directory for datasets (default: system temp)")
+    args = parser.parse_args(args)
+
+    config = dict(renderer="lut")
+    for kv in args.config:
+        k, v = kv.split("=", 1)
+        if k not in CONFIG_DEFAULT:
+            parser.error(f"Unknown config key '{k}'")
+        config[k] = v
+    phases = args.phases.split(",")
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    results = dict(
+        meta=dict(
+            date=datetime.now().isoformat(timespec="seconds"),
+            version=__version__,
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            numpy=np.__version__,
+            pandas=pd.__version__,
+            config=config,
+        ),
+        results=dict(),
+    )
+    tempdir = Path(tempfile.mkdtemp(prefix="annotation-bench-", dir=args.tempdir))
+    try:
+        for n in sizes:
+            results["results"][str(n)] = bench(
+                n, tempdir, config, phases,
+                n_register=args.n_register,
+                trace_memory=not args.no_tracemalloc)
+    finally:
+        shutil.rmtree(str(tempdir), ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, mode="w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results: {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, mode="r") as f:
+            baseline = json.load(f)
+        print(f"compare: {args.compare}")
+        regressions = compare(results, baseline, threshold=args.threshold)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
@@ -1,3 +1,4 @@
+import json
 import shutil
 from pathlib import Path
 
@@ -23,6 +24,12 @@ if VERBOSE:
     ARGS.append("-v")
 
 
+def update_config(**kwargs) -> None:
+    c = lib.config.load(file=CONFIGFILE)
+    c[SECTION].update({k: str(v) for k, v in kwargs.items()})
+    lib.config.save(c, file=CONFIGFILE, mode="overwrite", backup=False)
+
+
 @pytest.fixture(scope="class", autouse=True)
 def config(verbose=VERBOSE):
     if verbose:
@@ -71,3 +78,667 @@ class TestMain(object):
         args = ARGS + [option]
         _ = main(args=args)
         assert True
+
+    def test_deploy_lut(self, config):
+        update_config(renderer="lut")
+        args = ARGS + ["-d"]
+        _ = main(args=args)
+        imgs = list(Path(WORKDIR).glob("*.png"))
+        assert len(imgs) == config["n"]
+        assert imgs[0].read_bytes()[:8] == b"\x89PNG\r\n\x1a\n"
+
+    def test_deploy_workers(self, config):
+        args = ARGS + ["-d", "--workers", "2"]
+        _ = main(args=args)
+        imgs = list(Path(WORKDIR).glob("*.png"))
+        assert len(imgs) == config["n"]
+
+    def test_deploy_cache(self, config):
+        cachedir = Path(TEMPDIR) / "cache"
+        update_config(cachedir=cachedir, n="", n_example="")
+        for _ in range(2):
+            _ = main(args=ARGS + ["-d"])
+            imgs = list(Path(WORKDIR).glob("*.png"))
+            assert len(imgs) == 100
+            assert len(list(cachedir.glob("*/*.png"))) == 100
+
+        update_config(cache_size=0)
+        _ = main(args=ARGS + ["--prune-cache"])
+        assert len(list(cachedir.glob("*/*.png"))) == 0
+        update_config(cachedir="", cache_size=1024.0, n=30, n_example=5)
+
+    def test_register(self, config):
+        _ = main(args=ARGS + ["-d"])
+        df = pd.read_pickle(DATAFILE)
+        labeldir = Path(WORKDIR) / "x"
+        labeldir.mkdir()
+        moved = sorted(Path(WORKDIR).glob("*.png"))[:3]
+        for filepath in moved:
+            filepath.rename(labeldir / filepath.name)
+        (labeldir / ("INVALID" + config["imgext"])).touch()
+
+        _ = main(args=ARGS + ["-r"])
+        df = pd.read_pickle(DATAFILE)
+        ids = [filepath.stem for filepath in moved]
+        assert (df.set_index(config["col_filename"]).loc[ids, config["col_label"]] == "x").all()
+        assert (df[config["col_label"]] == "x").sum() == 3
+
+    def test_deploy_montage(self, config):
+        update_config(montage=1)
+        _ = main(args=ARGS + ["-d"])
+        files = [p for p in Path(WORKDIR).glob("*/*") if p.is_file()]
+        assert len(files) > 0
+        assert all(f.name == "_examples.png" for f in files)
+        assert len(list(Path(WORKDIR).glob("*.png"))) == config["n"]
+        _ = main(args=ARGS + ["-r"])
+        update_config(montage=0)
+
+    def test_register_journal(self, config):
+        update_config(journal=1)
+        journalfile = Path(DATAFILE + ".journal")
+        _ = main(args=ARGS + ["-d"])
+        labeldir = Path(WORKDIR) / "y"
+        labeldir.mkdir()
+        moved = sorted(Path(WORKDIR).glob("*.png"))[:2]
+        for filepath in moved:
+            filepath.rename(labeldir / filepath.name)
+        mtime = Path(DATAFILE).stat().st_mtime_ns
+
+        _ = main(args=ARGS + ["-r"])
+        assert Path(DATAFILE).stat().st_mtime_ns == mtime
+        assert len(journalfile.read_text().splitlines()) == 2
+
+        _ = main(args=ARGS + ["--compact"])
+        assert not journalfile.is_file()
+        df = pd.read_pickle(DATAFILE)
+        assert (df[config["col_label"]] == "y").sum() == 2
+        update_config(journal=0)
+
+    def test_convert_imgstore(self, config):
+        df = pd.read_pickle(DATAFILE)
+        _ = main(args=ARGS + ["--convert-imgstore"])
+        assert Path(DATAFILE + ".imgs.npy").is_file()
+        assert config["col_img"] not in pd.read_pickle(DATAFILE).columns
+        assert config["col_img"] in pd.read_pickle(DATAFILE + "~", compression="xz").columns
+
+        _ = main(args=ARGS + ["-d"])
+        assert len(list(Path(WORKDIR).glob("*.png"))) > 0
+
+        # restore
+        df.to_pickle(DATAFILE)
+        for suffix in [".imgs.npy", ".imgs.npz", "~"]:
+            Path(DATAFILE + suffix).unlink()
+
+    def test_loadcache(self, config, capsys):
+        loadcache = Path(TEMPDIR) / "loadcache"
+        update_config(loadcache=loadcache)
+        _ = main(args=ARGS + ["-d"])
+        assert len(list(loadcache.glob("*.pkl"))) == 1
+        _ = main(args=ARGS + ["-r"])
+        capsys.readouterr()
+        _ = main(args=ARGS + ["-d"])
+        assert "loadcache: " + str(list(loadcache.glob("*.pkl"))[0]) in capsys.readouterr().out
+        update_config(loadcache="")
+
+    def test_restore(self, config):
+        col_label = config["col_label"]
+        _ = main(args=ARGS + ["-r"])
+        before = pd.read_pickle(DATAFILE)[col_label]
+        _ = main(args=ARGS + ["-d"])
+        labeldir = Path(WORKDIR) / "z"
+        labeldir.mkdir()
+        for filepath in sorted(Path(WORKDIR).glob("*.png"))[:4]:
+            filepath.rename(labeldir / filepath.name)
+        _ = main(args=ARGS + ["-r"])
+        assert (pd.read_pickle(DATAFILE)[col_label] == "z").sum() == 4
+
+        _ = main(args=ARGS + ["--restore", "1"])
+        after = pd.read_pickle(DATAFILE)[col_label]
+        assert (before == after).all()
+
+        # journal entries are folded (and kept in a generation) before restoring
+        update_config(journal=1)
+        _ = main(args=ARGS + ["-d"])
+        labeldir = Path(WORKDIR) / "v"
+        labeldir.mkdir()
+        for filepath in sorted(Path(WORKDIR).glob("*.png"))[:2]:
+            filepath.rename(labeldir / filepath.name)
+        _ = main(args=ARGS + ["-r"])
+        _ = main(args=ARGS + ["--restore", "1"])
+        assert not Path(DATAFILE + ".journal").is_file()
+        labels = pd.read_pickle(DATAFILE)[col_label]
+        assert (labels == "z").sum() == 4 and (labels == "v").sum() == 0
+        _ = main(args=ARGS + ["--restore", "1"])
+        labels = pd.read_pickle(DATAFILE)[col_label]
+        assert (labels == "z").sum() == 0 and (labels == "v").sum() == 2
+        update_config(journal=0)
+
+    def test_export(self, config):
+        col_label = config["col_label"]
+        exportfile = Path(TEMPDIR) / "export.csv"
+        _ = main(args=ARGS + ["--export", str(exportfile), "--incremental"])
+        df = pd.read_csv(exportfile, index_col=0, keep_default_na=False)
+        assert len(df) == len(pd.read_pickle(DATAFILE))
+
+        _ = main(args=ARGS + ["-d"])
+        labeldir = Path(WORKDIR) / "w"
+        labeldir.mkdir()
+        for filepath in sorted(Path(WORKDIR).glob("*.png"))[:2]:
+            filepath.rename(labeldir / filepath.name)
+        _ = main(args=ARGS + ["-r"])
+        _ = main(args=ARGS + ["--export", str(exportfile), "--incremental"])
+        df_ = pd.read_csv(exportfile, index_col=0, keep_default_na=False)
+        assert len(df_) == len(df) + 2
+        assert (df_["label"].iloc[-2:] == "w").all()
+        expected = pd.read_pickle(DATAFILE).set_index(config["col_filename"])[col_label]
+        last = df_.groupby("id")["label"].last()
+        assert (last.loc[expected.index] == expected).all()
+
+    def test_watch(self, config):
+        import threading
+        from annotation.data import Data, Config
+
+        _ = main(args=ARGS + ["-d"])
+        c = Config(lib.config.load(
+            file=CONFIGFILE, default=CONFIG_DEFAULT, section=SECTION, cast=False))
+        c.update(datafile=DATAFILE, workdir=WORKDIR)
+        c.conv()
+        data = Data(c)
+        data.load()
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=data.watch, kwargs=dict(interval=0.05, save_interval=3600, stop=stop))
+        thread.start()
+
+        labeldir = Path(WORKDIR) / "v"
+        labeldir.mkdir()
+        moved = sorted(Path(WORKDIR).glob("*.png"))[:3]
+        for filepath in moved:
+            filepath.rename(labeldir / filepath.name)
+        for _ in range(100):
+            if data._label_index.count("v") == 3:
+                break
+            stop.wait(0.05)
+        assert data._label_index.count("v") == 3
+        stop.set()
+        thread.join()
+        assert (pd.read_pickle(DATAFILE)[config["col_label"]] == "v").sum() == 3
+
+    def test_prefetch(self, config):
+        import threading
+
+        def _wait():
+            for thread in threading.enumerate():
+                if thread.name == "prefetch":
+                    thread.join()
+
+        update_config(prefetch=1)
+        prefetchdir = Path(TEMPDIR) / ".work.next"
+        _ = main(args=ARGS + ["-d"])
+        _wait()
+        assert (prefetchdir / ".prefetch.json").is_file()
+        first = sorted(Path(WORKDIR).glob("*.png"))
+        assert len(first) == config["n"]
+        labeldir = Path(WORKDIR) / "u"
+        labeldir.mkdir()
+        for filepath in first[:2]:
+            filepath.rename(labeldir / filepath.name)
+
+        _ = main(args=ARGS + ["-r"])
+        second = sorted(Path(WORKDIR).glob("*.png"))
+        assert len(second) == config["n"]
+        assert not ({f.name for f in first} & {f.name for f in second})
+        _wait()
+        update_config(prefetch=0)
+        _ = main(args=ARGS + ["-d"])
+        assert not prefetchdir.is_dir()
+
+    def test_serve(self, config):
+        import threading
+        from urllib.request import urlopen, Request
+        from annotation.data import Data, Config
+        from annotation.server import AnnotationServer
+
+        c = Config(lib.config.load(
+            file=CONFIGFILE, default=CONFIG_DEFAULT, section=SECTION, cast=False))
+        c.update(datafile=DATAFILE, workdir=WORKDIR)
+        c.conv()
+        data = Data(c)
+        data.load()
+        server = AnnotationServer(data, port=0, save_interval=3600)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            def _get(path):
+                with urlopen(server.url + path) as r:
+                    return r.read()
+            ids = json.loads(_get("api/batch?n=5"))["ids"]
+            assert len(ids) == 5
+            assert not set(ids) & set(json.loads(_get("api/batch?n=5"))["ids"])
+            assert _get(f"img/{ids[0]}.png")[:8] == b"\x89PNG\r\n\x1a\n"
+
+            body = json.dumps(dict(labels={ids[0]: "s", ids[1]: "s", "INVALID": "s"}))
+            with urlopen(Request(server.url + "api/labels", data=body.encode(), method="POST")) as r:
+                assert json.loads(r.read()) == dict(n_success=2, n_failure=1)
+            assert "s" in json.loads(_get("api/info"))["labels"]
+
+            from urllib.error import HTTPError
+            for label in ["../pwn", "a/b", "a\\b", ".hidden", "", c["label_null"] or ""]:
+                body = json.dumps(dict(labels={ids[2]: label}))
+                with pytest.raises(HTTPError) as e:
+                    urlopen(Request(server.url + "api/labels", data=body.encode(), method="POST"))
+                assert e.value.code == 400
+            assert "../pwn" not in data.labels
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        assert (pd.read_pickle(DATAFILE)[config["col_label"]] == "s").sum() == 2
+
+    def test_deploy_result_shard(self, config):
+        update_config(shard=1)
+        _ = main(args=ARGS + ["--deploy-result"])
+        files = list(Path(WORKDIR).glob("x/*/*.png"))
+        assert len(files) == 3
+        assert all(len(f.parent.name) == 1 for f in files)
+        assert len(list(Path(WORKDIR).glob("x/*.png"))) == 0
+
+        # the label directory decides the label (even in a shard subdirectory)
+        moved = files[0]
+        dst = Path(WORKDIR) / "y" / "0"
+        dst.mkdir(exist_ok=True)
+        moved.rename(dst / moved.name)
+        _ = main(args=ARGS + ["-r"])
+        df = pd.read_pickle(DATAFILE).set_index(config["col_filename"])
+        assert df.loc[moved.stem, config["col_label"]] == "y"
+        assert len(list(Path(WORKDIR).iterdir())) == 0
+        update_config(shard=0)
+
+    def test_register_manifest(self, config, capsys):
+        _ = main(args=ARGS + ["--deploy-result"])
+        assert (Path(WORKDIR) / ".manifest.npz").is_file()
+        moved = sorted(Path(WORKDIR).glob("x/*.png"))[0]
+        moved.rename(Path(WORKDIR) / "y" / moved.name)
+        capsys.readouterr()
+        _ = main(args=ARGS + ["-r"])
+        assert "data.register: n_success=1 n_failure=0" in capsys.readouterr().out
+        df = pd.read_pickle(DATAFILE).set_index(config["col_filename"])
+        assert df.loc[moved.stem, config["col_label"]] == "y"
+        assert not (Path(WORKDIR) / ".manifest.npz").is_file()
+
+    def test_deploy_similar(self, config):
+        update_config(similar=1)
+        _ = main(args=ARGS + ["-d"])
+        assert Path(DATAFILE + ".features.npy").is_file()
+        files = sorted(Path(WORKDIR).glob("*.png"))
+        assert len(files) == config["n"]
+        assert [f.name[:5] for f in files[:2]] == ["0000_", "0001_"]
+
+        moved = files[0]
+        labeldir = Path(WORKDIR) / "t"
+        labeldir.mkdir()
+        moved.rename(labeldir / moved.name)
+        _ = main(args=ARGS + ["-r"])
+        df = pd.read_pickle(DATAFILE).set_index(config["col_filename"])
+        assert df.loc[moved.name[5:-4], config["col_label"]] == "t"
+        update_config(similar=0)
+
+    def test_fastclear(self, config):
+        from annotation.data import _WorkDir
+        update_config(fastclear=1)
+        for _ in range(2):
+            _ = main(args=ARGS + ["-d"])
+            assert len(list(Path(WORKDIR).glob("*.png"))) == config["n"]
+        _WorkDir.wait()
+        assert len(list(Path(TEMPDIR).glob(".work.trash-*"))) == 0
+        update_config(fastclear=0)
+
+    def test_profile(self, config):
+        tracefile = Path(TEMPDIR) / "trace.json"
+        _ = main(args=ARGS + ["-d", "--profile", str(tracefile)])
+        with tracefile.open() as f:
+            trace = json.load(f)
+        names = {e["name"] for e in trace["traceEvents"]}
+        assert {"load", "deploy", "save_images"} <= names
+
+
+def test_render_discrete():
+    import io
+    import numpy as np
+    from PIL import Image
+    from annotation.render import Renderer, encode_png
+
+    m = np.random.default_rng(0).integers(0, 3, size=(26, 26), dtype=np.uint8)
+    for discrete, vmin, vmax in [("auto", None, None), ([0, 1, 2], 0.0, 2.0)]:
+        renderer = Renderer(
+            engine="lut", cmap="coolwarm", vmin=vmin, vmax=vmax, discrete=discrete)
+        idx, palette = renderer.to_indexed(m)
+        rgba = renderer.to_array(m)
+        img = Image.open(io.BytesIO(encode_png(idx, palette=palette)))
+        assert img.mode == "P"
+        assert (np.asarray(img.convert("RGBA")) == rgba).all()
+    assert renderer.to_indexed(m + 0.5) is None
+
+
+def test_montage_seaborn(monkeypatch):
+    import numpy as np
+    from annotation.render import Renderer, DPI
+
+    renderer = Renderer(engine="seaborn", figsize=(1, 1))
+    # examples are tiled first, not drawn one figure each
+    monkeypatch.setattr(Renderer, "to_array", lambda self, m: pytest.fail("to_array"))
+    imgs = [np.random.default_rng(i).random((10, 12)) for i in range(5)]
+    arr = renderer.montage(imgs)
+    assert arr.shape == (2 * DPI, 3 * DPI, 4)
+    assert arr.dtype == np.uint8
+
+
+def test_watch_shard(tmp_path):
+    from annotation.watch import LabelDirWatcher
+
+    shard = tmp_path / "a" / "0"
+    shard.mkdir(parents=True)
+    watcher = LabelDirWatcher(tmp_path, imgext=".png")
+    watcher.racy = 0.0
+    assert watcher.poll() == ([], [])
+    (tmp_path / "x.png").write_bytes(b"")
+    (tmp_path / "x.png").rename(shard / "x.png")
+    assert watcher.poll() == (["x"], ["a"])
+    assert watcher.poll() == ([], [])
+
+
+def test_label_index():
+    import numpy as np
+    from annotation.labelindex import LabelIndex
+
+    rng = np.random.default_rng(0)
+    labels = rng.choice(["", "a", "b"], size=1000).astype(object)
+    index = LabelIndex(labels)
+    for _ in range(20):
+        positions = rng.choice(1000, size=50, replace=False)
+        label = str(rng.choice(["", "a", "b", "c"]))
+        labels[positions] = label
+        index.move(positions, label)
+    for label in ["", "a", "b", "c", "d"]:
+        expected = np.flatnonzero(labels == label)
+        assert index.count(label) == len(expected)
+        assert (np.sort(index.positions(label)) == expected).all()
+        assert set(index.sample(label, 10, rng=rng)) <= set(expected)
+
+
+# budget of CLI startup imports [s]
+IMPORT_TIME_BUDGET = 0.5
+
+
+@pytest.mark.parametrize("option", ["--version", "--help"])
+def test_import_time(option):
+    import sys
+    import subprocess
+
+    r = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "annotation", option],
+        capture_output=True, text=True)
+    assert r.returncode == 0
+    modules = dict()
+    total = 0
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+        if not name.startswith("  "):
+            # top-level import
+            total += int(cumulative)
+    assert "annotation" in modules
+    for heavy in ["pandas", "matplotlib", "seaborn", "tkinter", "tqdm", "numpy"]:
+        assert heavy not in modules
+    assert total / 1e6 < IMPORT_TIME_BUDGET
+
+
+def test_dedup(tmp_path):
+    import numpy as np
+    from annotation.data import Data
+    from annotation.defaults import Config
+    from annotation import dedup
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 3, size=(20, 20)).astype(np.uint8)
+    other = rng.integers(0, 3, size=(20, 20)).astype(np.uint8)
+    imgs = [base, base.copy(), np.rot90(base), base[:, ::-1].copy(), other]
+    assert len(set(dedup.exact_hashes(imgs).tolist())) == 4
+    codes = dedup.group_codes(dedup.perceptual_hashes(imgs))
+    assert len(set(codes[:4].tolist())) == 1
+    assert codes[4] != codes[0]
+
+    # different local defects on the same wafer are not near-duplicates
+    wafer = np.ones((26, 26), dtype=np.uint8)
+    wafers = [wafer.copy() for _ in range(4)]
+    wafers[0][2:4, 2:4] = 2
+    wafers[1][20:22, 8:10] = 2
+    wafers[2][5, 9:11] = 2
+    wafers[2][17, 13:15] = 2
+    wafers[3] = np.rot90(wafers[0]).copy()
+    codes = dedup.group_codes(dedup.perceptual_hashes(wafers))
+    assert len(set(codes[:3].tolist())) == 3
+    assert codes[3] == codes[0]
+
+    datafile = tmp_path / "data.pkl"
+    pd.DataFrame(dict(
+        id=[f"m{i}" for i in range(len(imgs))], img=imgs, label="",
+    )).to_pickle(datafile)
+    workdir = tmp_path / "work"
+    config = Config(CONFIG_DEFAULT)
+    config.update(
+        datafile=str(datafile), workdir=str(workdir),
+        random=0, dedup=2, n_example=0, backup=0)
+    config.conv()
+    data = Data(config)
+    data.load()
+    assert Path(str(datafile) + ".dedup.npz").is_file()
+    data.deploy()
+    deployed = sorted(p.stem for p in workdir.glob("*.png"))
+    assert deployed == ["m0", "m2", "m3", "m4"]
+
+    # exact duplicates are labelled together
+    (workdir / "a").mkdir()
+    (workdir / "m0.png").rename(workdir / "a" / "m0.png")
+    data.register()
+    df = pd.read_pickle(datafile).set_index("id")
+    assert df["label"].tolist() == ["a", "a", "", "", ""]
+
+    # near-duplicates are suggested (presorted) and confirmed by register
+    data.deploy()
+    assert sorted(p.stem for p in (workdir / "a").glob("*.png")) == ["m2", "m3"]
+    assert sorted(p.stem for p in workdir.glob("*.png")) == ["m4"]
+    data.register()
+    df = pd.read_pickle(datafile).set_index("id")
+    assert df["label"].tolist() == ["a", "a", "a", "a", ""]
+
+    # hashes survive label saves, but not a regenerated datafile with the same ids
+    cachefile = Path(str(datafile) + ".dedup.npz")
+    mtime = cachefile.stat().st_mtime_ns
+    Data(config).load()
+    assert cachefile.stat().st_mtime_ns == mtime
+    pd.DataFrame(dict(
+        id=[f"m{i}" for i in range(len(imgs))], img=[np.rot90(other)] + imgs[1:], label="",
+    )).to_pickle(datafile)
+    data = Data(config)
+    data.load()
+    assert cachefile.stat().st_mtime_ns != mtime
+    assert data._dup_groups.n_duplicates == 0
+
+
+def test_presort(tmp_path):
+    import numpy as np
+    from annotation.data import Data
+    from annotation.defaults import Config
+
+    rng = np.random.default_rng(0)
+    # "a": defects in the top half, "b": defects in the bottom half
+    imgs = list()
+    for i in range(40):
+        m = np.zeros((16, 16), dtype=np.uint8)
+        rows = slice(0, 8) if i % 2 == 0 else slice(8, 16)
+        m[rows] = rng.integers(1, 3, size=(8, 16))
+        imgs.append(m)
+    labels = ["a" if i % 2 == 0 else "b" for i in range(10)] + [""] * 30
+    datafile = tmp_path / "data.pkl"
+    pd.DataFrame(dict(
+        id=[f"m{i:02d}" for i in range(len(imgs))], img=imgs, label=labels,
+    )).to_pickle(datafile)
+    workdir = tmp_path / "work"
+    config = Config(CONFIG_DEFAULT)
+    config.update(
+        datafile=str(datafile), workdir=str(workdir), labels="a,b",
+        n=10, n_example=0, random=0, presort="0.9", uncertain=1, backup=0)
+    config.conv()
+    data = Data(config)
+    data.load()
+    fits = list()
+    get_model = Data.get_model
+    data.get_model = lambda: fits.append(1) or get_model(data)
+    data.deploy()
+    # one fit for both uncertainty sampling and presort
+    assert len(fits) == 1
+    presorted = {p.stem: p.parent.name for p in workdir.glob("*/*.png")}
+    assert len(presorted) == 10
+    assert all(label == ("a" if int(name[1:]) % 2 == 0 else "b")
+               for name, label in presorted.items())
+
+    # confirm all but one (moved back to the root)
+    name, label = sorted(presorted.items())[0]
+    (workdir / label / (name + ".png")).rename(workdir / (name + ".png"))
+    data.register()
+    df = pd.read_pickle(datafile).set_index("id")
+    assert (df["label"] != "").sum() == 10 + 9
+    assert df.loc[name, "label"] == ""
+
+
+def test_lut_without_pyplot():
+    import sys
+    import subprocess
+
+    code = (
+        "import sys, numpy as np\n"
+        "from annotation.render import Renderer\n"
+        "Renderer(engine='lut', cmap='coolwarm').to_png(np.zeros((5, 5)))\n"
+        "assert 'matplotlib.pyplot' not in sys.modules\n"
+    )
+    r = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr
+
+
+def test_register_moved_while_rendering(tmp_path, monkeypatch):
+    import numpy as np
+    from annotation.data import Data
+    from annotation.defaults import Config
+
+    datafile = tmp_path / "data.pkl"
+    pd.DataFrame(dict(
+        id=[f"m{i}" for i in range(5)],
+        img=[np.full((4, 4), i, dtype=np.uint8) for i in range(5)],
+        label="",
+    )).to_pickle(datafile)
+    workdir = tmp_path / "work"
+    config = Config(CONFIG_DEFAULT)
+    config.update(
+        datafile=str(datafile), workdir=str(workdir), labels="a",
+        random=0, n_example=0, backup=0)
+    config.conv()
+    data = Data(config)
+    data.load()
+
+    render_batch = Data._render_batch
+
+    def _render_and_move(self, *args, **kwargs):
+        render_batch(self, *args, **kwargs)
+        # the annotator moves a file before deploy writes the manifest
+        (workdir / "m0.png").rename(workdir / "a" / "m0.png")
+
+    monkeypatch.setattr(Data, "_render_batch", _render_and_move)
+    data.deploy()
+    assert data.register() == (1, 0)
+    assert pd.read_pickle(datafile).set_index("id").loc["m0", "label"] == "a"
+
+
+def test_prefetch_lock(tmp_path):
+    import sys
+    import subprocess
+    import numpy as np
+    from annotation.data import Data
+    from annotation.defaults import Config
+
+    datafile = tmp_path / "data.pkl"
+    pd.DataFrame(dict(
+        id=[f"m{i}" for i in range(6)],
+        img=[np.full((4, 4), i, dtype=np.uint8) for i in range(6)],
+        label="",
+    )).to_pickle(datafile)
+    config = Config(CONFIG_DEFAULT)
+    config.update(
+        datafile=str(datafile), workdir=str(tmp_path / "work"),
+        n=2, n_example=0, random=0, renderer="lut", backup=0)
+    config.conv()
+    data = Data(config)
+    data.load()
+    renderer = data.get_renderer()
+
+    # another process is rendering: its staging directory is left alone
+    other = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        staging = Path(f"{data.prefetchdir}.tmp-{other.pid}")
+        staging.mkdir()
+        data._prefetch_lockfile.write_text(str(other.pid))
+        data._start_prefetch(renderer, exclude=np.empty(0, dtype=np.int64))
+        assert staging.is_dir()
+        assert data._prefetch_owner() == other.pid
+    finally:
+        other.kill()
+        other.wait()
+
+    # the lock of a dead process is stale
+    data._start_prefetch(renderer, exclude=np.empty(0, dtype=np.int64))
+    data._wait_prefetch()
+    assert not staging.is_dir()
+    assert not data._prefetch_lockfile.is_file()
+    assert (data.prefetchdir / ".prefetch.json").is_file()
+    assert data._prefetch_owner() is None
+
+
+def test_feature_cache(tmp_path):
+    import numpy as np
+    from annotation.data import Data
+    from annotation.defaults import Config
+
+    rng = np.random.default_rng(0)
+    ids = [f"m{i}" for i in range(6)]
+    datafile = tmp_path / "data.pkl"
+    pd.DataFrame(dict(
+        id=ids, img=list(rng.integers(0, 3, size=(6, 8, 8))), label="",
+    )).to_pickle(datafile)
+    config = Config(CONFIG_DEFAULT)
+    config.update(datafile=str(datafile), workdir=str(tmp_path / "work"), backup=0)
+    config.conv()
+
+    def features():
+        data = Data(config)
+        data.load()
+        return data, np.array(data.get_features())
+
+    data, feats = features()
+    # saving labels keeps the cache valid
+    data._set_labels(np.arange(2), "a")
+    data.save(clear_workdir=False)
+    cachefile = Path(str(datafile) + ".features.npy")
+    mtime = cachefile.stat().st_mtime_ns
+    _, cached = features()
+    assert cachefile.stat().st_mtime_ns == mtime
+    assert np.array_equal(cached, feats)
+
+    # regenerated datafile with the same ids
+    pd.DataFrame(dict(
+        id=ids, img=list(rng.integers(0, 3, size=(6, 12, 12))), label="",
+    )).to_pickle(datafile)
+    _, regenerated = features()
+    assert cachefile.stat().st_mtime_ns != mtime
+    assert not np.array_equal(regenerated, feats)
@@ -141,3 +141,21 @@ class TestConfig(object):
         config_load = lib.config.load(file=CONFIGFILE)
         assert config_load != config
         assert config_load == sampleconfig
+
+
+class TestCompression(object):
+    @pytest.mark.parametrize("codec", ["xz", "gzip", "bz2", "none"])
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_roundtrip(self, codec, workers):
+        data = bytes(range(256)) * 1000
+        compressed = lib.compression.compress(
+            data, codec=codec, level=1, workers=workers, chunksize=50000)
+        assert lib.compression.detect(compressed) == codec
+        assert lib.compression.decompress(compressed, workers=workers) == data
+
+    def test_standard(self):
+        import gzip, lzma
+        data = bytes(range(256)) * 1000
+        for codec, module in [("xz", lzma), ("gzip", gzip)]:
+            compressed = lib.compression.compress(data, codec=codec, chunksize=50000)
+            assert module.decompress(compressed) == data